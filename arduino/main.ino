@@ -1,5 +1,14 @@
 #define TYPE_INDEX 0
 #define DATA_INDEX 1
+#define TAG_CHAR '#'
+#define PROTOCOL_VERSION 2
+#define FRAME_START 0x02
+#define NO_SEQUENCE 0xFFFF
+#define SAMPLE_COUNT 16
+#define SETTLE_TIME 15
+// Longest message kept, without the line ending. Must match
+// Communication.MAX_MESSAGE_LENGTH in python.
+#define MAX_MESSAGE_LENGTH 480
 #define PITCH_SERVO_PIN 9
 #define YAW_SERVO_PIN 10
 #define DISTANCE_SENSOR_PIN 0
@@ -10,6 +19,9 @@ Servo yawServo;
 
 int current_pitch;
 int current_yaw;
+// Incoming message. Its buffer is reserved once in setup, so long scan lines
+// do not fragment the 2 KB of SRAM.
+String message;
 
 bool setServoPosition(int pitch, int yaw) {
     /* Set the servos to the given pitch and yaw.
@@ -26,7 +38,7 @@ bool setServoPosition(int pitch, int yaw) {
     return true;
 }
 
-String respondSensorMessage(String message) {
+String respondSensorMessage(const String &message) {
     /* Decodes sensor command messages and generates response.
      * 
      * Parameters:
@@ -44,7 +56,69 @@ String respondSensorMessage(String message) {
     return response.substring(0, response.length() - 1);
 }
 
-String respondServoMessage(String message) {
+void writeFrameByte(uint8_t value, uint8_t *sum1, uint8_t *sum2) {
+    /* Write a byte of a binary frame and add it to the Fletcher-16 checksum.
+     *
+     * Parameters:
+     *  value (uint8_t): the byte to be written.
+     *  sum1 (uint8_t*): running first sum of the checksum.
+     *  sum2 (uint8_t*): running second sum of the checksum.
+     */
+    Serial.write(value);
+    *sum1 = (*sum1 + value) % 255;
+    *sum2 = (*sum2 + *sum1) % 255;
+}
+
+void sendSensorFrame(char messageType, uint16_t sequence) {
+    /* Sample the distance sensor and send the readings as a binary frame.
+     *
+     * The frame is a start byte followed by the message type, the sequence
+     * tag and the payload length (uint16, little endian), the readings
+     * (uint16, little endian) and a Fletcher-16 checksum over everything
+     * after the start byte.
+     *
+     * Parameters:
+     *  messageType (char): the type of the frame, 'S' for a sensor response
+     *      or 'P' for a point of a scan line.
+     *  sequence (uint16_t): sequence tag of the request, NO_SEQUENCE if none.
+     */
+    uint8_t sum1 = 0;
+    uint8_t sum2 = 0;
+    uint16_t length = SAMPLE_COUNT * 2;
+    Serial.write(FRAME_START);
+    writeFrameByte(messageType, &sum1, &sum2);
+    writeFrameByte(sequence & 0xFF, &sum1, &sum2);
+    writeFrameByte(sequence >> 8, &sum1, &sum2);
+    writeFrameByte(length & 0xFF, &sum1, &sum2);
+    writeFrameByte(length >> 8, &sum1, &sum2);
+    for (int i = 0; i < SAMPLE_COUNT; i++) {
+        uint16_t distance = analogRead(DISTANCE_SENSOR_PIN);
+        writeFrameByte(distance & 0xFF, &sum1, &sum2);
+        writeFrameByte(distance >> 8, &sum1, &sum2);
+    }
+    Serial.write(sum1);
+    Serial.write(sum2);
+}
+
+String respondTestMessage(const String &message) {
+    /* Answers the handshake and agrees on a protocol version.
+     *
+     * Parameters:
+     *  message (String): Data from test message, "12345" optionally followed
+     *      by "V" and the highest protocol version python supports.
+     *
+     * Returns:
+     *  (String): message to be sent as a response
+     */
+    int versionIndex = message.indexOf('V');
+    if (versionIndex < 0) {
+        return "12345";
+    }
+    int version = min((int)message.substring(versionIndex + 1).toInt(), PROTOCOL_VERSION);
+    return "12345V" + String(version, DEC);
+}
+
+String respondServoMessage(const String &message) {
     /* Decodes motor command messages and generates response.
      * 
      * Parameters:
@@ -55,13 +129,71 @@ String respondServoMessage(String message) {
      */
     int pitch = message.substring(0, 3).toInt();
     int yaw = message.substring(4, 7).toInt();
-    int waitTime = 15;
+    int waitTime = SETTLE_TIME;
     setServoPosition(pitch, yaw);
     String response = String(waitTime, DEC);
     return response;
 }
 
-void sendMessage(char messageType, String messageData) {
+int parseNumber(const String &message, int start, int digits) {
+    /* Parse a fixed width decimal number without copying the message.
+     *
+     * Parameters:
+     *  message (String): the message containing the number.
+     *  start (int): index of the first digit.
+     *  digits (int): number of digits.
+     *
+     * Returns:
+     *  (int): the parsed number.
+     */
+    int value = 0;
+    for (int i = start; i < start + digits; i++) {
+        value = value * 10 + (message.charAt(i) - '0');
+    }
+    return value;
+}
+
+String respondScanLineMessage(const String &message, int start, int stop, uint16_t sequence) {
+    /* Moves to every target of a scan line, waits for the servos to settle
+     * and streams the sensor readings back as binary 'P' frames.
+     *
+     * The targets are parsed in place, a scan line is too long to copy.
+     * 
+     * Parameters:
+     *  message (String): the raw message containing the scan line.
+     *  start (int): index of the first target in message.
+     *  stop (int): index after the last target in message. The targets are
+     *      comma separated, each formatted like the data of a motor message
+     *      and optionally followed by "@" and the settle time in hundredths
+     *      of a second.
+     *  sequence (uint16_t): sequence tag of the request, NO_SEQUENCE if none.
+     * 
+     * Returns:
+     *  (String): number of points measured, sent as the final response
+     */
+    int count = 0;
+    while (start + 7 <= stop) {
+        int end = message.indexOf(',', start);
+        if (end < 0 || end > stop) {
+            end = stop;
+        }
+        int pitch = parseNumber(message, start, 3);
+        int yaw = parseNumber(message, start + 4, 3);
+        // An optional "@SSS" suffix overrides the settle time in hundredths.
+        unsigned long settle = SETTLE_TIME * 100;
+        if (end - start >= 11 && message.charAt(start + 7) == '@') {
+            settle = parseNumber(message, start + 8, 3) * 10UL;
+        }
+        setServoPosition(pitch, yaw);
+        delay(settle);
+        sendSensorFrame('P', sequence);
+        count++;
+        start = end + 1;
+    }
+    return String(count, DEC);
+}
+
+void sendMessage(char messageType, const String &messageData) {
     /* Send a message to python using serial
      * 
      * Parameters:
@@ -73,27 +205,50 @@ void sendMessage(char messageType, String messageData) {
     Serial.println(messageData);
 }
 
-void analyzeMessage(String message) {
+void analyzeMessage(const String &message) {
     /* Decode serial messages from python and execute corresponding
-     * response function and returns the response.
+     * response function and returns the response. A sequence tag at the end
+     * of the message (e.g. "#12") is copied to the end of the response.
      * 
      * Parameters:
      *  message (String): the raw message sent over serial from python.
      */
     char messageType = message.charAt(TYPE_INDEX);
-    String data = message.substring(DATA_INDEX);
     String response;
+    // Pipelined messages end with a sequence tag that is echoed in the response.
+    String tag = "";
+    uint16_t sequence = NO_SEQUENCE;
+    int dataEnd = message.length();
+    int tagIndex = message.lastIndexOf(TAG_CHAR);
+    if (tagIndex >= 0) {
+        tag = message.substring(tagIndex);
+        tag.trim();
+        dataEnd = tagIndex;
+        sequence = tag.substring(1).toInt();
+    }
+    if (messageType == 'R') {
+        // Scan lines are long, parse them in place instead of copying them.
+        response = respondScanLineMessage(message, DATA_INDEX, dataEnd, sequence);
+        sendMessage('R', response + tag);
+        return;
+    }
+    String data = message.substring(DATA_INDEX, dataEnd);
     switch (messageType) {
         case 'M':
             response = respondServoMessage(data);
-            sendMessage('M', response);
+            sendMessage('M', response + tag);
             break;
         case 'S':
-            response = respondSensorMessage(data);
-            sendMessage('S', response);
+            if (data.startsWith("BIN")) {
+                sendSensorFrame('S', sequence);
+            } else {
+                response = respondSensorMessage(data);
+                sendMessage('S', response + tag);
+            }
             break;
         case 'T':
-            sendMessage('T', "12345");
+            response = respondTestMessage(data);
+            sendMessage('T', response + tag);
             break;
     }
 }
@@ -104,6 +259,7 @@ void setup() {
      */
     Serial.begin(115200);
     Serial.flush();
+    message.reserve(MAX_MESSAGE_LENGTH);
     pinMode(LED_BUILTIN, OUTPUT);
     digitalWrite(LED_BUILTIN, LOW);
 
@@ -121,8 +277,14 @@ void loop() {
      */
     if (Serial.available() > 0) {
         digitalWrite(LED_BUILTIN, HIGH);
-        String message = Serial.readStringUntil('\n');
-        analyzeMessage(message);
+        char next = Serial.read();
+        if (next == '\n') {
+            analyzeMessage(message);
+            // Keeps the reserved buffer.
+            message = "";
+        } else if (next != '\r' && message.length() < MAX_MESSAGE_LENGTH) {
+            message += next;
+        }
     } else {
         digitalWrite(LED_BUILTIN, LOW);
     }
@@ -0,0 +1,7 @@
+import sys
+
+from scanviz.benchmark import SweepBenchmark
+
+resolutions = [int(arg) for arg in sys.argv[1:]] or [5, 10, 20]
+benchmark = SweepBenchmark(resolutions=resolutions)
+print(benchmark.report(benchmark.run()))
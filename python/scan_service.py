@@ -0,0 +1,6 @@
+import sys
+
+from scanviz.service import ScannerService
+
+port = sys.argv[1] if len(sys.argv) > 1 else None
+ScannerService(port=port).serve_forever()
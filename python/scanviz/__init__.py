@@ -1 +1,17 @@
-from .scanner import Scanner
\ No newline at end of file
+import importlib
+
+# Submodules are imported on first use, so that importing scanviz is fast and
+# thin clients of the scanner service never load numpy or matplotlib.
+_EXPORTS = {
+    "Scanner": "scanner",
+    "ScannerPool": "pool",
+    "Visualization": "visualization",
+    "ScannerService": "service",
+    "ScanClient": "service",
+}
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
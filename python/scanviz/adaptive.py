@@ -0,0 +1,164 @@
+import logging
+import logging.config
+import os
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class AdaptiveSweep():
+    """Coarse to fine scan that only refines cells where the range changes.
+
+    A coarse grid is measured first. Every cell between four neighbouring
+    points is scored by how much the range varies over its corners. The
+    highest scoring cells are split into four quadrants, which needs their
+    center and edge midpoints, until no cell exceeds the threshold, the
+    maximum depth is reached or the point budget is spent.
+    """
+
+    CRITERIA = ["range", "variance"]
+
+    def __init__(
+        self,
+        scanner,
+        coarse_resolution=9,
+        max_points=900,
+        threshold=5.0,
+        max_depth=3,
+        criterion="range",
+        span=30,
+    ):
+        """Instantiate an AdaptiveSweep object.
+
+        Parameters:
+            scanner (Scanner): Scanner used to measure the points.
+            coarse_resolution (int): Points per side of the initial grid.
+            max_points (int): Total number of points the scan may measure.
+            threshold (float): Cells scoring above this are refined. In inches
+                for the "range" criterion and square inches for "variance".
+            max_depth (int): Number of times a coarse cell may be split. The
+                servos move in whole degrees, so finer cells are pointless.
+            criterion (str): Cell score, one of CRITERIA. "range" is the
+                difference between the largest and smallest corner distance,
+                "variance" the variance of the corner distances.
+            span (float): The scan covers -span to span degrees on both axes.
+        """
+        if criterion not in self.CRITERIA:
+            raise ValueError(f"Unknown refinement criterion: {criterion}")
+        if coarse_resolution < 2:
+            raise ValueError("The coarse grid needs at least 2 points per side.")
+        self.scanner = scanner
+        self.coarse_resolution = coarse_resolution
+        self.max_points = max_points
+        self.threshold = threshold
+        self.max_depth = max_depth
+        self.criterion = criterion
+        self.span = span
+        self.radius = {}
+
+    def run(self):
+        """Run the scan.
+
+        Returns:
+            (numpy.ndarray): Pitch angle of every measured point.
+            (numpy.ndarray): Yaw angle of every measured point.
+            (numpy.ndarray): Measured distance of every point.
+        """
+        self.radius = {}
+        angles = np.linspace(-self.span, self.span, self.coarse_resolution)
+        pitch_mesh, yaw_mesh = np.meshgrid(angles, angles)
+        self._measure([
+            self._key(pitch, yaw)
+            for pitch, yaw in zip(np.ravel(pitch_mesh), np.ravel(yaw_mesh))
+        ])
+        size = angles[1] - angles[0]
+        cells = [
+            (pitch, yaw, size, 0)
+            for pitch in angles[:-1]
+            for yaw in angles[:-1]
+        ]
+        while True:
+            candidates = sorted(
+                (cell for cell in cells if cell[3] < self.max_depth),
+                key=self._score,
+                reverse=True,
+            )
+            candidates = [cell for cell in candidates if self._score(cell) > self.threshold]
+            budget = self.max_points - len(self.radius)
+            split = []
+            targets = set()
+            for cell in candidates:
+                new = set(self._new_points(cell)) - targets
+                if len(targets) + len(new) > budget:
+                    break
+                split += [cell]
+                targets |= new
+            if not split:
+                break
+            logger.info(f"Refining {len(split)} cells with {len(targets)} new points.")
+            self._measure(sorted(targets))
+            for cell in split:
+                cells.remove(cell)
+                cells += self._children(cell)
+        keys = list(self.radius)
+        logger.info(f"Adaptive scan finished with {len(keys)} points.")
+        return (
+            np.array([key[0] for key in keys]),
+            np.array([key[1] for key in keys]),
+            np.array([self.radius[key] for key in keys]),
+        )
+
+    def _key(self, pitch, yaw):
+        """Dictionary key of a point, robust against rounding errors."""
+        return (round(float(pitch), 6), round(float(yaw), 6))
+
+    def _corners(self, cell):
+        """Keys of the four corners of a cell."""
+        pitch, yaw, size, _ = cell
+        return [
+            self._key(pitch, yaw),
+            self._key(pitch + size, yaw),
+            self._key(pitch, yaw + size),
+            self._key(pitch + size, yaw + size),
+        ]
+
+    def _score(self, cell):
+        """How much the measured range varies over the corners of a cell."""
+        distances = np.array([self.radius[key] for key in self._corners(cell)])
+        if self.criterion == "range":
+            return distances.max() - distances.min()
+        return distances.var()
+
+    def _new_points(self, cell):
+        """Keys of the center and edge midpoints that are not measured yet."""
+        pitch, yaw, size, _ = cell
+        half = size / 2
+        points = [
+            self._key(pitch + half, yaw + half),
+            self._key(pitch + half, yaw),
+            self._key(pitch + half, yaw + size),
+            self._key(pitch, yaw + half),
+            self._key(pitch + size, yaw + half),
+        ]
+        return [point for point in points if point not in self.radius]
+
+    def _children(self, cell):
+        """The four quadrants of a cell."""
+        pitch, yaw, size, depth = cell
+        half = size / 2
+        return [
+            (pitch + dp, yaw + dy, half, depth + 1)
+            for dp in (0, half)
+            for dy in (0, half)
+        ]
+
+    def _measure(self, points):
+        """Measure a list of (pitch, yaw) keys and store their distances."""
+        pitches = np.array([point[0] for point in points])
+        yaws = np.array([point[1] for point in points])
+        for measured in self.scanner.iter_points(pitches, yaws):
+            self.radius[points[measured["index"]]] = measured["distance"]
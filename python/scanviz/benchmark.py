@@ -0,0 +1,161 @@
+import time
+import logging
+import logging.config
+import os
+
+import numpy as np
+from scanviz.communication import Communication
+from scanviz.emulator import EmulatedArduino
+from scanviz.planner import PathPlanner
+from scanviz.scanner import Scanner
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class SweepBenchmark():
+    """Measure sweep throughput against an emulated scanner."""
+
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(
+        self,
+        resolutions=(5, 10, 20),
+        baudrate=115200,
+        settle_time=0.05,
+        adc_noise=4.0,
+        seed=0,
+        window=None,
+        planner=None,
+        protocol_version=Communication.PROTOCOL_VERSION,
+    ):
+        """Instantiate a SweepBenchmark object.
+
+        Parameters:
+            resolutions (tuple): Resolutions passed to Scanner.sweep.
+            baudrate (int): Baudrate of the emulated link.
+            settle_time (float): Seconds waited for the servos at every point.
+                Sets the wait time of the emulated firmware and of the default
+                planner, which decides how long sweeps wait.
+            adc_noise (float): Standard deviation of the emulated ADC noise.
+            seed (int): Seed for the emulated ADC noise.
+            window (int): Number of commands kept in flight on a pipelined link.
+                The link is synchronous when omitted.
+            planner (PathPlanner): Planner used by the scanner. Defaults to a
+                serpentine PathPlanner that waits settle_time at every point.
+            protocol_version (int): Highest protocol version of the emulated
+                firmware. Scan lines are used from version 2 on, use 1 to
+                measure the pipelined or synchronous point by point path.
+        """
+        self.resolutions = resolutions
+        self.baudrate = baudrate
+        self.settle_time = settle_time
+        self.adc_noise = adc_noise
+        self.seed = seed
+        self.window = window
+        if planner is None:
+            planner = PathPlanner(
+                min_settle=settle_time, seconds_per_degree=0, max_settle=settle_time
+            )
+        self.planner = planner
+        self.protocol_version = protocol_version
+
+    def create_device(self):
+        """Create the emulated device a single benchmark run talks to.
+
+        Returns:
+            (EmulatedArduino): A fresh emulated scanner.
+        """
+        return EmulatedArduino(
+            baudrate=self.baudrate,
+            settle_time=self.settle_time,
+            adc_noise=self.adc_noise,
+            seed=self.seed,
+            protocol_version=self.protocol_version,
+        )
+
+    def run_resolution(self, resolution):
+        """Time a single sweep.
+
+        Parameters:
+            resolution (int): Resolution passed to Scanner.sweep.
+        Returns:
+            (dict): Throughput, latency and wire usage of the sweep.
+        """
+        device = self.create_device()
+        try:
+            comms = Communication(port=device)
+            if self.window is not None:
+                comms.start_pipeline(self.window)
+            scanner = Scanner(comms=comms, planner=self.planner)
+            device.measurement_times.clear()
+            bytes_before = device.bytes_written + device.bytes_read
+            start = time.monotonic()
+            radius = scanner.sweep(resolution, visualize=False)
+            elapsed = time.monotonic() - start
+            wire_bytes = device.bytes_written + device.bytes_read - bytes_before
+            latency = np.diff([start] + device.measurement_times)
+            comms.stop_pipeline()
+        finally:
+            device.close()
+        points = np.size(radius)
+        result = {
+            "resolution": resolution,
+            "protocol_version": comms.protocol_version,
+            "points": points,
+            "seconds": elapsed,
+            "points_per_second": points / elapsed,
+            "bytes": wire_bytes,
+            "bytes_per_point": wire_bytes / points,
+        }
+        for percentile in self.PERCENTILES:
+            result[f"latency_p{percentile}"] = float(np.percentile(latency, percentile))
+        result["latency_max"] = float(np.max(latency))
+        return result
+
+    def run(self):
+        """Run the benchmark for every configured resolution.
+
+        Returns:
+            (list): One result dictionary per resolution.
+        """
+        scanner_logger = logging.getLogger("scanviz.scanner")
+        level = scanner_logger.level
+        # Per point debug logging would dominate the measurement.
+        scanner_logger.setLevel(logging.INFO)
+        try:
+            results = []
+            for resolution in self.resolutions:
+                logger.info(f"Benchmarking sweep({resolution})...")
+                results += [self.run_resolution(resolution)]
+        finally:
+            scanner_logger.setLevel(level)
+        return results
+
+    def report(self, results):
+        """Format benchmark results as a table.
+
+        Parameters:
+            results (list): Results returned by run.
+        Returns:
+            (str): Human readable table, one row per resolution.
+        """
+        header = (
+            f"{'res':>4} {'ver':>3} {'points':>7} {'seconds':>8} {'pts/s':>8}"
+            + "".join(f" {'p' + str(p) + ' ms':>9}" for p in self.PERCENTILES)
+            + f" {'max ms':>9} {'bytes':>8} {'B/pt':>6}"
+        )
+        lines = [header]
+        for result in results:
+            lines += [
+                f"{result['resolution']:>4} {result['protocol_version']:>3} {result['points']:>7}"
+                f" {result['seconds']:>8.2f} {result['points_per_second']:>8.2f}"
+                + "".join(
+                    f" {result[f'latency_p{p}'] * 1000:>9.1f}" for p in self.PERCENTILES
+                )
+                + f" {result['latency_max'] * 1000:>9.1f}"
+                f" {result['bytes']:>8} {result['bytes_per_point']:>6.1f}"
+            ]
+        return "\n".join(lines)
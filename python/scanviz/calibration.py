@@ -0,0 +1,130 @@
+import logging
+import logging.config
+import os
+
+import numpy as np
+from numpy.polynomial import polynomial
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class Calibration():
+    """Convert raw readings of the IR distance sensor into inches."""
+
+    ADC_RESOLUTION = 1024
+    # inches = 48.7 - 0.15 * adc + 0.000134 * adc**2, lowest order first.
+    DEFAULT_COEFFICIENTS = (48.7, -0.15, 0.000134)
+    AGGREGATIONS = ["mean", "median", "trimmed"]
+
+    def __init__(self, coefficients=DEFAULT_COEFFICIENTS, aggregation="mean", trim=0.25):
+        """Instantiate a Calibration object.
+
+        The calibration curve is evaluated once for every possible 10-bit ADC
+        value, so converting readings is a single table lookup.
+
+        Parameters:
+            coefficients (tuple): Polynomial coefficients of the calibration
+                curve, lowest order first.
+            aggregation (str): How the readings of a point are combined, one of
+                AGGREGATIONS. The mean keeps the resolution below a single ADC
+                count, the median and the trimmed mean ignore spikes.
+            trim (float): Fraction of readings dropped from each end by the
+                trimmed mean.
+        """
+        if aggregation not in self.AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation: {aggregation}")
+        if not 0 <= trim < 0.5:
+            raise ValueError(f"Trim fraction must be in [0, 0.5): {trim}")
+        self.coefficients = tuple(coefficients)
+        self.aggregation = aggregation
+        self.trim = trim
+        self.table = polynomial.polyval(np.arange(self.ADC_RESOLUTION), self.coefficients)
+
+    def convert(self, samples):
+        """Convert raw readings into distances.
+
+        Parameters:
+            samples (numpy.ndarray): Raw ADC readings of any shape.
+        Returns:
+            (numpy.ndarray): Distance in inches of every reading.
+        """
+        indices = np.clip(np.asarray(samples, dtype=np.intp), 0, self.ADC_RESOLUTION - 1)
+        return self.table[indices]
+
+    def aggregate(self, distances, axis=-1):
+        """Combine the distances measured for a point.
+
+        Parameters:
+            distances (numpy.ndarray): Converted readings.
+            axis (int): Axis holding the readings of a single point.
+        Returns:
+            (numpy.ndarray): Aggregated distance with axis removed.
+        """
+        if self.aggregation == "mean":
+            return np.mean(distances, axis=axis)
+        if self.aggregation == "median":
+            return np.median(distances, axis=axis)
+        distances = np.sort(distances, axis=axis)
+        count = np.shape(distances)[axis]
+        cut = int(count * self.trim)
+        return np.mean(np.take(distances, np.arange(cut, count - cut), axis=axis), axis=axis)
+
+    def distance(self, samples, axis=-1):
+        """Convert and aggregate raw readings.
+
+        Parameters:
+            samples (numpy.ndarray): Raw ADC readings, for example one row of 16
+                readings per point of a sweep.
+            axis (int): Axis holding the readings of a single point.
+        Returns:
+            (numpy.ndarray): Distance in inches of every point.
+        """
+        return self.aggregate(self.convert(samples), axis=axis)
+
+    @classmethod
+    def fit(cls, samples, distances, degree=2, **kwargs):
+        """Fit a calibration curve to readings taken at known distances.
+
+        Parameters:
+            samples (numpy.ndarray): Raw ADC readings.
+            distances (numpy.ndarray): True distance in inches of every reading.
+            degree (int): Degree of the fitted polynomial.
+            **kwargs: Passed on to the Calibration constructor.
+        Returns:
+            (Calibration): Calibration using the fitted curve.
+        """
+        samples = np.ravel(samples)
+        distances = np.ravel(distances)
+        if len(samples) != len(distances):
+            raise ValueError("Every reading needs a matching distance.")
+        coefficients = polynomial.polyfit(samples, distances, degree)
+        residual = distances - polynomial.polyval(samples, coefficients)
+        logger.info(
+            f"Fitted calibration curve {coefficients} with an RMS error of"
+            f" {np.sqrt(np.mean(residual**2)):.3f} inches."
+        )
+        return cls(coefficients, **kwargs)
+
+    @classmethod
+    def from_recordings(cls, recordings, degree=2, **kwargs):
+        """Fit a calibration curve to output of arduino/calibration/sensor.ino.
+
+        Parameters:
+            recordings (dict): Maps the distance in inches the sensor was placed
+                at to a file with the serial output recorded there, one reading
+                per line.
+            degree (int): Degree of the fitted polynomial.
+            **kwargs: Passed on to the Calibration constructor.
+        Returns:
+            (Calibration): Calibration using the fitted curve.
+        """
+        samples = []
+        distances = []
+        for distance, path in recordings.items():
+            readings = np.loadtxt(path, ndmin=1)
+            samples += [readings]
+            distances += [np.full(len(readings), distance, dtype=float)]
+        return cls.fit(np.concatenate(samples), np.concatenate(distances), degree, **kwargs)
@@ -3,8 +3,16 @@ import serial.tools.list_ports
 import logging
 import logging.config
 import os
+import queue
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
+import numpy as np
 import serial
+from scanviz.instrumentation import Instrumentation
 
 logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
 logging.config.fileConfig(logger_path, disable_existing_loggers=False)
@@ -15,16 +23,179 @@ class Communication():
     """Infrastructure for serial communication with the Arduino."""
 
     EOM = "\r\n"
-    SEND_MESSAGE_TYPES = ["M", "S", "T"]
-    RECIEVE_MESSAGE_TYPES = ["M", "S","T"]
+    TAG = "#"
+    MAX_SEQUENCE = 1000
+    # Longest message the Arduino keeps, without the EOM. See main.ino.
+    MAX_MESSAGE_LENGTH = 480
+    SEND_MESSAGE_TYPES = ["M", "S", "T", "R"]
+    RECIEVE_MESSAGE_TYPES = ["M", "S","T", "R", "P"]
 
-    def __init__(self, baudrate=115200, port=None):
+    # Binary frames: start byte, header (type, sequence, payload length),
+    # payload of little endian uint16 samples and a Fletcher-16 checksum over
+    # everything after the start byte. Version 2 adds the R scan line command.
+    PROTOCOL_VERSION = 2
+    FRAME_START = b"\x02"
+    FRAME_HEADER = struct.Struct("<cHH")
+    FRAME_CHECKSUM = struct.Struct("<H")
+    NO_SEQUENCE = 0xFFFF
+    # Instrumentation counters of the receive error codes.
+    ERROR_COUNTERS = {1: "unknown_messages", 2: "empty_responses", 3: "checksum_errors"}
+    # The last port a handshake succeeded on. Auto discovery tries it first.
+    PORT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "scanviz", "port")
+    HANDSHAKE_INTERVAL = 0.25
+
+    def __init__(
+        self,
+        baudrate=115200,
+        port=None,
+        protocol_version=PROTOCOL_VERSION,
+        instrumentation=None,
+        connect_timeout=10,
+    ):
         """Instantiate a Communication object.
 
         Parameters:
             baudrate (int): the baudrate of the serial port. This should match the
                 baudrate set on the arduino.
-            port (str): the serial port where the arduino is connected.
+            port (str): the serial port where the arduino is connected. An already
+                open pyserial-compatible object, such as an EmulatedArduino, can be
+                passed instead.
+            protocol_version (int): highest protocol version to negotiate. Version
+                0 is the original text protocol, version 1 adds binary sensor
+                frames and version 2 the R scan line command. Older firmware
+                always falls back to version 0.
+            instrumentation (Instrumentation): Times writes and reads and counts
+                receive errors. Disabled by default.
+            connect_timeout (float): Seconds to keep sending the handshake while
+                the Arduino boots.
+
+        Raises:
+            IOError: when no Arduino is found or it does not answer the handshake.
+        """
+        self.instrumentation = (
+            instrumentation if instrumentation is not None else Instrumentation(enabled=False)
+        )
+        self._write_lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._pending_lock = threading.Lock()
+        self._sequence = 0
+        self._stop_sequence = None
+        self._window = None
+        self._window_size = 0
+        self._reader = None
+        self.protocol_version = 0
+
+        if isinstance(port, str):
+            logger.info("Starting communication with Arduino...")
+            self._open(port, baudrate, protocol_version, connect_timeout)
+            return
+        if port is not None:
+            logger.info("Starting communication with serial device...")
+            self.arduino = port
+            self._handshake(protocol_version, connect_timeout)
+            return
+        cached_port = self.cached_port()
+        if cached_port is not None and os.path.exists(cached_port):
+            logger.info(f"Trying the last used port: {cached_port}")
+            try:
+                self._open(cached_port, baudrate, protocol_version, connect_timeout)
+                return
+            except Exception as error:
+                logger.info(f"The last used port failed, looking for Arduino: {error}")
+                self.forget_port()
+        logger.info("Looking for Arduino...")
+        arduino_ports = [name for name in self.discover_ports() if name != cached_port]
+        if not arduino_ports:
+            raise IOError("No Arduino found.")
+        if len(arduino_ports) > 1:
+            logger.info(f"Multiple Arduinos found! Using the first: {arduino_ports[0]}")
+        logger.info(f"Possible Arduino Found: {arduino_ports[0]}")
+        logger.info("Attempting to connect...")
+        self._open(arduino_ports[0], baudrate, protocol_version, connect_timeout)
+
+    def _open(self, port_name, baudrate, protocol_version, connect_timeout):
+        """Open a serial port and handshake, remembering the port on success.
+
+        Parameters:
+            port_name (str): Device name of the serial port.
+            baudrate (int): Baudrate of the serial port.
+            protocol_version (int): Highest protocol version to negotiate.
+            connect_timeout (float): Seconds to keep sending the handshake.
+        Raises:
+            IOError: when the Arduino does not answer the handshake.
+            serial.SerialException: when the port cannot be opened.
+        """
+        self.arduino = serial.Serial(port=port_name, baudrate=baudrate, timeout=5)
+        try:
+            self._handshake(protocol_version, connect_timeout)
+        except Exception:
+            self.arduino.close()
+            if port_name == self.cached_port():
+                self.forget_port()
+            raise
+        self.remember_port(port_name)
+
+    def _handshake(self, protocol_version, connect_timeout):
+        """Negotiate the protocol version with the Arduino.
+
+        Parameters:
+            protocol_version (int): Highest protocol version to negotiate.
+            connect_timeout (float): Seconds to keep sending the handshake.
+        Raises:
+            IOError: when the Arduino does not answer the handshake.
+        """
+        self.arduino.flush()
+        self.protocol_version = 0
+        handshake = f"12345V{protocol_version}" if protocol_version > 0 else "12345"
+        response = self._poll_handshake(handshake, connect_timeout)
+        if response["message_type"] != "T" or not response["data"].startswith("12345"):
+            logger.info(f"ERROR: {response}")
+            raise IOError(f"No handshake from the Arduino: {response}")
+        version = response["data"][len("12345V"):]
+        self.protocol_version = min(int(version), protocol_version) if version.isdigit() else 0
+        logger.info(f"Serial communication ready! Protocol version {self.protocol_version}.")
+
+    def _poll_handshake(self, handshake, timeout):
+        """Send the handshake until the Arduino answers or the timeout passes.
+
+        Opening the port resets the Arduino, which ignores messages until its
+        bootloader exits. Polling connects as soon as it is ready instead of
+        always waiting for the slowest boot.
+
+        Parameters:
+            handshake (str): data of the test message.
+            timeout (float): seconds to keep trying.
+        Returns:
+            (dict): the last response received.
+        """
+        read_timeout = self.arduino.timeout
+        self.arduino.timeout = self.HANDSHAKE_INTERVAL
+        deadline = time.monotonic() + timeout
+        attempts = 0
+        try:
+            while True:
+                attempts += 1
+                self.send("T", handshake)
+                response = self.receive()
+                if response["message_type"] == "T" or time.monotonic() >= deadline:
+                    break
+            if attempts > 1:
+                # Answers to earlier attempts may still be on their way.
+                time.sleep(self.HANDSHAKE_INTERVAL)
+                self.arduino.reset_input_buffer()
+        finally:
+            self.arduino.timeout = read_timeout
+        if attempts > 1:
+            self.instrumentation.count("handshake_retries", attempts - 1)
+            logger.info(f"Arduino answered after {attempts} handshakes.")
+        return response
+
+    @staticmethod
+    def discover_ports():
+        """Find the serial ports that Arduinos are likely connected to.
+
+        Returns:
+            (list): Device names, the most likely Arduino first.
         """
         def port_sort(port):
             """Sort the list of serial ports. For use in sort function.
@@ -41,35 +212,57 @@ class Communication():
                 return 1
             else:
                 return 0
-        
-        if isinstance(port, str):
-            logger.info("Starting communication with Arduino...")
-            self.arduino = serial.Serial(port=port, baudrate=baudrate, timeout=5)
-        else:
-            logger.info("Looking for Arduino...")
-            serial_ports = [
-                port
-                for port in serial.tools.list_ports.comports()
-                if "Arduino" in port.description or "ACM" in port.device
-            ]
-            if not serial_ports:
-                raise IOError("No Arduino found.")
-            serial_ports.sort(reverse=True, key=port_sort)
-            arduino_ports = [port.device for port in serial_ports]
-            if len(arduino_ports) > 1:
-                logger.info(f"Multiple Arduinos found! Using the first: {arduino_ports[0]}")
-            logger.info(f"Possible Arduino Found: {arduino_ports[0]}")
-            logger.info("Attempting to connect...")
-            self.arduino = serial.Serial(port=arduino_ports[0], baudrate=baudrate, timeout=5)
-
-        time.sleep(5)
-        self.arduino.flush()
-        response = self.send_recieve("T","12345")
-        if response["data"] == "12345":
-            logger.info("Serial communication ready!")
-        else:
-            logger.info(f"ERROR: {response}")
-   
+
+        serial_ports = [
+            port
+            for port in serial.tools.list_ports.comports()
+            if "Arduino" in port.description or "ACM" in port.device
+        ]
+        serial_ports.sort(reverse=True, key=port_sort)
+        return [port.device for port in serial_ports]
+
+    @classmethod
+    def cached_port(cls):
+        """The port of the last successful connection.
+
+        Returns:
+            (str): Device name, or None if no port has been remembered.
+        """
+        try:
+            with open(cls.PORT_CACHE) as cache:
+                return cache.read().strip() or None
+        except OSError:
+            return None
+
+    @classmethod
+    def remember_port(cls, port):
+        """Store the port to try first the next time.
+
+        Parameters:
+            port (str): Device name of the port.
+        """
+        try:
+            os.makedirs(os.path.dirname(cls.PORT_CACHE), exist_ok=True)
+            with open(cls.PORT_CACHE, "w") as cache:
+                cache.write(port)
+        except OSError as error:
+            logger.info(f"Could not remember the port: {error}")
+
+    @classmethod
+    def forget_port(cls):
+        """Delete the remembered port, so the next connection searches again."""
+        try:
+            os.remove(cls.PORT_CACHE)
+        except OSError:
+            pass
+
+    def close(self):
+        """Stop the pipeline, if running, and close the serial port."""
+        try:
+            if self.pipelined:
+                self.stop_pipeline()
+        finally:
+            self.arduino.close()
 
     def send(self, message_type, message_data):
         """Send data to the arduino.
@@ -86,16 +279,40 @@ class Communication():
         if message_type not in self.SEND_MESSAGE_TYPES:
             raise ValueError(f"Incorrect message type: {message_type}")
         message = f"{message_type}{message_data}{self.EOM}"
-        self.arduino.write(bytes(message, 'utf-8'))
+        with self._write_lock, self.instrumentation.span("write"):
+            self.arduino.write(bytes(message, 'utf-8'))
         
         
     def receive(self):
         """Receive data from the arduino.
 
+        Text messages carry their data as a string. Binary frames carry their
+        data as a numpy array of samples.
+
         Returns:
             (dict): contains message type, processed data, and error value.
         """
-        raw_data = self.arduino.read_until(bytes(self.EOM, 'utf-8')).decode("utf-8") 
+        with self.instrumentation.span("wait"):
+            first_byte = self.arduino.read(1)
+        with self.instrumentation.span("read"):
+            if first_byte == self.FRAME_START:
+                response = self._receive_frame()
+            else:
+                response = self._receive_text(first_byte)
+        if response["error"]:
+            self.instrumentation.count(self.ERROR_COUNTERS[response["error"]])
+        return response
+
+    def _receive_text(self, first_byte):
+        """Receive the rest of a text message after its first byte.
+
+        Returns:
+            (dict): contains message type, processed data, and error value.
+        """
+        raw_data = first_byte
+        if first_byte:
+            raw_data += self.arduino.read_until(bytes(self.EOM, 'utf-8'))
+        raw_data = raw_data.decode("utf-8")
         try:
             message_type = raw_data[0]
         except IndexError:
@@ -106,10 +323,12 @@ class Communication():
             }
         if message_type in self.RECIEVE_MESSAGE_TYPES:
             data = raw_data.split("\n")[0].split("\r")[0][1:]
+            data, _, sequence = data.partition(self.TAG)
             return {
                 "message_type": message_type,
                 "data": data,
                 "error": 0,
+                "sequence": int(sequence) if sequence.isdigit() else None,
             }
         else:
             return {
@@ -117,7 +336,73 @@ class Communication():
                 "data": raw_data,
                 "error": 1,
             }
-    
+
+    def _receive_frame(self):
+        """Receive the rest of a binary frame after its start byte.
+
+        Returns:
+            (dict): contains message type, decoded samples, and error value.
+        """
+        header = self.arduino.read(self.FRAME_HEADER.size)
+        if len(header) < self.FRAME_HEADER.size:
+            return {
+                "message_type": "ERROR",
+                "data": "EMPTY",
+                "error": 2,
+            }
+        message_type, sequence, length = self.FRAME_HEADER.unpack(header)
+        body = self.arduino.read(length + self.FRAME_CHECKSUM.size)
+        payload = body[:length]
+        if (
+            len(body) < length + self.FRAME_CHECKSUM.size
+            or self.FRAME_CHECKSUM.unpack(body[length:])[0] != self.checksum(header + payload)
+        ):
+            return {
+                "message_type": "ERROR",
+                "data": header + body,
+                "error": 3,
+            }
+        return {
+            "message_type": message_type.decode("utf-8"),
+            "data": np.frombuffer(payload, dtype="<u2"),
+            "error": 0,
+            "sequence": None if sequence == self.NO_SEQUENCE else sequence,
+        }
+
+    @staticmethod
+    def checksum(data):
+        """Compute the Fletcher-16 checksum of a binary frame.
+
+        Parameters:
+            data (bytes): frame contents after the start byte.
+        Returns:
+            (int): checksum with sum1 in the low byte and sum2 in the high byte.
+        """
+        values = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+        sum1 = int(values.sum()) % 255
+        sum2 = int(np.dot(np.arange(len(values), 0, -1), values)) % 255
+        return (sum2 << 8) | sum1
+
+    @classmethod
+    def encode_frame(cls, message_type, samples, sequence=None):
+        """Build a binary frame the way the firmware does.
+
+        Parameters:
+            message_type (str): the message type of the frame.
+            samples (list): 16-bit samples to pack into the payload.
+            sequence (int): sequence tag of the command being answered.
+        Returns:
+            (bytes): the complete frame.
+        """
+        payload = np.asarray(samples, dtype="<u2").tobytes()
+        header = cls.FRAME_HEADER.pack(
+            bytes(message_type, 'utf-8'),
+            cls.NO_SEQUENCE if sequence is None else sequence,
+            len(payload),
+        )
+        checksum = cls.FRAME_CHECKSUM.pack(cls.checksum(header + payload))
+        return cls.FRAME_START + header + payload + checksum
+
     def send_recieve(self, message_type, message_data):
         """Send data and expect a response.
 
@@ -128,8 +413,274 @@ class Communication():
         Returns:
             (dict): contains message type, processed data, and error value.
         """
+        if self.pipelined:
+            return self._result(self.send_async(message_type, message_data))
         self.send(message_type, message_data)
         response = self.receive()
         if response["message_type"] != message_type:
             raise ValueError(f"Unexpected message type. Message: {response}")
-        return response
\ No newline at end of file
+        return response
+
+    def send_stream(self, message_type, message_data, item_type):
+        """Send a command that is answered by a stream of messages.
+
+        The Arduino answers with any number of item_type messages followed by a
+        single message_type message that ends the stream. The generator has to be
+        consumed completely before the next command is sent on a synchronous link.
+
+        Parameters:
+            message_type (str): the message type. Must be a type listed in the send
+                message type list stored in the communications class.
+            message_data (str): data to be send over the serial bus to the arduino.
+            item_type (str): message type of the streamed responses.
+        Yields:
+            (dict): every streamed response, as returned by receive.
+        Returns:
+            (dict): the response that ended the stream.
+        """
+        if self.pipelined:
+            items = queue.Queue()
+            future = self._submit(message_type, message_data, items=(item_type, items))
+            while True:
+                response = items.get()
+                if response is None:
+                    return self._result(future)
+                yield response
+        self.send(message_type, message_data)
+        while True:
+            response = self.receive()
+            if response["message_type"] == item_type:
+                yield response
+            elif response["message_type"] == message_type:
+                return response
+            else:
+                raise ValueError(f"Unexpected message type. Message: {response}")
+
+    @property
+    def pipelined(self):
+        """(bool): True while the pipelined command channel is running."""
+        return self._reader is not None
+
+    def start_pipeline(self, window=4):
+        """Switch to pipelined mode.
+
+        Commands are tagged with a sequence number and written without waiting
+        for the previous response. A background thread reads the responses and
+        resolves the matching futures. Responses without a tag, as sent by older
+        firmware, are matched in order.
+
+        Parameters:
+            window (int): Maximum number of commands in flight. The Arduino only
+                buffers 64 bytes of input, so keep this small.
+        """
+        if self.pipelined:
+            return
+        if window < 1:
+            raise ValueError(f"Pipeline window must be at least 1: {window}")
+        self._window = threading.BoundedSemaphore(window)
+        self._window_size = window
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+        logger.info(f"Pipelined communication started with a window of {window}.")
+
+    def stop_pipeline(self):
+        """Wait for all commands in flight and return to synchronous mode.
+
+        Raises:
+            IOError: when the Arduino stops answering, e.g. after it dropped out.
+        """
+        if not self.pipelined:
+            return
+        # The test message is answered after everything already in flight and
+        # tells the reader thread to stop once its response has been handled.
+        reader = self._reader
+        future = self._submit("T", "12345", stop=True)
+        reader.join(self._pipeline_timeout())
+        if reader.is_alive():
+            # The reader is stuck in a read, it exits once the read returns.
+            self._fail_pipeline(IOError("Pipelined reader did not stop."))
+        self._reader = None
+        self._window = None
+        self._result(future)
+        logger.info("Pipelined communication stopped.")
+
+    def _result(self, future):
+        """Wait for the response of a pipelined command.
+
+        Parameters:
+            future (concurrent.futures.Future): future returned by send_async.
+        Returns:
+            (dict): the response.
+
+        Raises:
+            IOError: when no response arrives in time.
+        """
+        timeout = self._pipeline_timeout()
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise IOError(f"No response from the Arduino within {timeout} s.")
+
+    def _pipeline_timeout(self):
+        """Longest wait for a pipelined command, None without a read timeout.
+
+        Every command ahead of it in the window may take up to the read timeout
+        of the port, so the wait is bounded by the timeout times the window.
+        """
+        timeout = self.arduino.timeout
+        if timeout is not None:
+            timeout *= self._window_size + 1
+        return timeout
+
+    def send_async(self, message_type, message_data):
+        """Queue a command in pipelined mode.
+
+        Blocks while the window of commands in flight is full.
+
+        Parameters:
+            message_type (str): the message type. Must be a type listed in the send
+                message type list stored in the communications class.
+            message_data (str): data to be send over the serial bus to the arduino.
+        Returns:
+            (concurrent.futures.Future): resolves to the response dictionary.
+
+        Raises:
+            RuntimeError: when the pipeline has not been started.
+        """
+        if not self.pipelined:
+            raise RuntimeError("Pipelined communication has not been started.")
+        return self._submit(message_type, message_data)
+
+    def _submit(self, message_type, message_data, stop=False, items=None):
+        """Tag a command, register its future and write it to the Arduino.
+
+        items is an optional (item_type, queue.Queue) pair. Streamed responses of
+        item_type are put on the queue, followed by None once the stream ends.
+        """
+        window = self._window
+        if window is None:
+            raise IOError("Pipelined communication has stopped.")
+        window.acquire()
+        future = Future()
+        with self._pending_lock:
+            if self._window is not window:
+                # The reader failed while waiting for a free slot.
+                window.release()
+                future.set_exception(IOError("Pipelined communication has stopped."))
+                return future
+            sequence = self._sequence
+            self._sequence = (self._sequence + 1) % self.MAX_SEQUENCE
+            self._pending[sequence] = (message_type, future, items, self._deadline())
+            if stop:
+                self._stop_sequence = sequence
+        try:
+            self.send(message_type, f"{message_data}{self.TAG}{sequence}")
+        except Exception as error:
+            self._resolve(sequence, exception=error)
+        return future
+
+    def _read_loop(self):
+        """Read responses and hand them to the futures waiting for them.
+
+        If reading fails, for example because the port was unplugged, every
+        command in flight fails and the pipeline stops. A read that times out
+        only fails the oldest command, and only once its deadline has passed.
+        """
+        while True:
+            try:
+                response = self.receive()
+            except Exception as error:
+                logger.info(f"Pipelined reader failed: {error!r}")
+                self._fail_pipeline(IOError(f"Pipelined reader failed: {error!r}"))
+                return
+            with self._pending_lock:
+                if self._reader is not threading.current_thread():
+                    # The pipeline was stopped without waiting for this thread.
+                    return
+                sequence = response.get("sequence")
+                oldest = next(iter(self._pending), None)
+                if response["error"] == 2:
+                    # Nothing arrived within the read timeout. Commands are
+                    # answered in order, so only the oldest one can be late.
+                    if oldest is None or not self._expired(oldest):
+                        continue
+                    sequence = oldest
+                elif sequence is None:
+                    # Untagged responses belong to the oldest command.
+                    sequence = oldest
+                elif sequence not in self._pending:
+                    # A late answer to a command that has already failed.
+                    sequence = None
+                stop = sequence is not None and sequence == self._stop_sequence
+                items = self._pending[sequence][2] if sequence is not None else None
+            if sequence is None:
+                if response["error"] != 2:
+                    self.instrumentation.count("dropped_messages")
+                    logger.info(f"Dropping unexpected message: {response}")
+                continue
+            if items is not None and response["message_type"] == items[0]:
+                with self._pending_lock:
+                    self._extend(sequence)
+                items[1].put(response)
+                continue
+            self._resolve(sequence, response=response)
+            if stop:
+                self._stop_sequence = None
+                return
+
+    def _deadline(self):
+        """Time by which the Arduino has to answer, or None without a read timeout."""
+        if self.arduino.timeout is None:
+            return None
+        return time.monotonic() + self.arduino.timeout
+
+    def _expired(self, sequence):
+        """Whether a pending command has passed its deadline, called with the lock held."""
+        deadline = self._pending[sequence][3]
+        return deadline is not None and time.monotonic() >= deadline
+
+    def _extend(self, sequence):
+        """Give a pending command the full read timeout from now, called with the lock held.
+
+        Commands wait behind the ones ahead of them, so the deadline is pushed
+        back whenever the Arduino makes progress.
+        """
+        message_type, future, items, deadline = self._pending[sequence]
+        if deadline is not None:
+            deadline = max(deadline, self._deadline())
+        self._pending[sequence] = (message_type, future, items, deadline)
+
+    def _fail_pipeline(self, exception):
+        """Fail every command in flight and mark the pipeline as stopped."""
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._stop_sequence = None
+            window = self._window
+            self._window = None
+            self._reader = None
+        for message_type, future, items, deadline in pending:
+            # Wake up threads waiting for a slot, they see the stopped pipeline.
+            window.release()
+            future.set_exception(exception)
+            if items is not None:
+                items[1].put(None)
+
+    def _resolve(self, sequence, response=None, exception=None):
+        """Complete the future of a command and free its slot in the window."""
+        with self._pending_lock:
+            if sequence not in self._pending:
+                return
+            message_type, future, items, deadline = self._pending.pop(sequence)
+            window = self._window
+            if self._pending:
+                self._extend(next(iter(self._pending)))
+        window.release()
+        if exception is None and response["message_type"] != message_type:
+            exception = ValueError(f"Unexpected message type. Message: {response}")
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(response)
+        if items is not None:
+            items[1].put(None)
@@ -0,0 +1,406 @@
+import time
+import logging
+import logging.config
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+from scanviz.calibration import Calibration
+from scanviz.communication import Communication
+from scanviz.planner import PathPlanner
+from scanviz.scanner import Scanner
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Calibration curve of the IR distance sensor (inches = A + B*adc + C*adc**2).
+CURVE_A, CURVE_B, CURVE_C = Calibration.DEFAULT_COEFFICIENTS
+
+
+def default_scene(pitch, yaw):
+    """Distance to a flat wall with a box placed in front of its center.
+
+    Parameters:
+        pitch (float): Scanner pitch angle in degrees.
+        yaw (float): Scanner yaw angle in degrees.
+    Returns:
+        (float): Distance in inches from the sensor to the scene along the ray.
+    """
+    if abs(pitch) < 10 and abs(yaw) < 10:
+        return 18.0
+    return 36.0 / (np.cos(np.deg2rad(pitch)) * np.cos(np.deg2rad(yaw)))
+
+
+def distance_to_adc(distance):
+    """Invert the sensor calibration curve.
+
+    Parameters:
+        distance (float): Distance in inches.
+    Returns:
+        (float): Raw ADC value the sensor would report for that distance.
+    """
+    vertex = -CURVE_B / (2 * CURVE_C)
+    minimum = CURVE_A + CURVE_B * vertex + CURVE_C * vertex**2
+    distance = np.clip(distance, minimum, CURVE_A)
+    discriminant = CURVE_B**2 - 4 * CURVE_C * (CURVE_A - distance)
+    return (-CURVE_B - np.sqrt(np.maximum(discriminant, 0))) / (2 * CURVE_C)
+
+
+class EmulatedArduino():
+    """Software stand-in for the scanner running arduino/main.ino.
+
+    The object mimics the parts of ``serial.Serial`` used by Communication so
+    it can be passed in place of a real port. A device thread answers the
+    same M/S/T line protocol as the firmware while modelling the time spent
+    on the wire, the servo settle time and the noise of the ADC.
+    """
+
+    def __init__(
+        self,
+        baudrate=115200,
+        timeout=5,
+        settle_time=1.5,
+        servo_speed=600.0,
+        servo_damping=0.02,
+        adc_noise=4.0,
+        sample_time=0.0001,
+        link_latency=0.004,
+        samples=16,
+        protocol_version=Communication.PROTOCOL_VERSION,
+        scene=default_scene,
+        seed=None,
+        boot_time=0.0,
+    ):
+        """Instantiate an emulated scanner.
+
+        Parameters:
+            baudrate (int): Simulated baudrate. Every byte costs 10 bit times
+                (8N1 framing) in both directions.
+            timeout (float): Read timeout in seconds, as in pyserial.
+            settle_time (float): Seconds the firmware waits for the servos by
+                default. This is reported to the host in tenths of a second, like
+                the waitTime of the firmware.
+            servo_speed (float): Degrees per second the servos actually move.
+                Readings taken before a move is finished still see the old
+                position.
+            servo_damping (float): Seconds the servos need to stop ringing after
+                any move.
+            adc_noise (float): Standard deviation of the gaussian noise added
+                to every ADC reading.
+            sample_time (float): Seconds needed for a single analogRead.
+            link_latency (float): Fixed delay in seconds added to every transfer,
+                like the buffering of the USB to serial converter.
+            samples (int): Number of ADC readings returned per sensor message.
+            protocol_version (int): Highest protocol version the emulated
+                firmware supports. Use 0 to emulate the text-only firmware.
+            scene (callable): Maps (pitch, yaw) in degrees to a distance in
+                inches.
+            seed (int): Seed for the noise generator.
+            boot_time (float): Seconds after opening during which messages are
+                ignored, like while the bootloader of a reset Arduino runs.
+        """
+        self.port = "emulator"
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.settle_time = settle_time
+        self.servo_speed = servo_speed
+        self.servo_damping = servo_damping
+        self.adc_noise = adc_noise
+        self.sample_time = sample_time
+        self.link_latency = link_latency
+        self.samples = samples
+        self.protocol_version = protocol_version
+        self.scene = scene
+        self.is_open = True
+
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.measurement_times = []
+
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Condition()
+        self._incoming = bytearray()
+        self._lines = deque()
+        self._outgoing = deque()
+        self._buffer = bytearray()
+        self._rx_free_at = 0.0
+        self._tx_free_at = 0.0
+
+        self._pitch = 150
+        self._yaw = 90
+        self._previous = (self._pitch, self._yaw)
+        self._settled_at = 0.0
+        self._booted_at = time.monotonic() + boot_time
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def byte_time(self):
+        """(float): Seconds needed to move a single byte over the link."""
+        return 10.0 / self.baudrate
+
+    @property
+    def in_waiting(self):
+        """(int): Number of bytes that have arrived and can be read."""
+        with self._lock:
+            self._collect()
+            return len(self._buffer)
+
+    def write(self, data):
+        """Send bytes to the emulated device.
+
+        Parameters:
+            data (bytes): Raw bytes written by the host.
+        Returns:
+            (int): Number of bytes written.
+        """
+        if not self.is_open:
+            raise IOError("Emulated port is closed.")
+        with self._lock:
+            now = time.monotonic()
+            self._rx_free_at = max(now, self._rx_free_at) + len(data) * self.byte_time
+            self.bytes_written += len(data)
+            self._incoming += data
+            while b"\n" in self._incoming:
+                end = self._incoming.index(b"\n") + 1
+                arrival = self._rx_free_at + self.link_latency
+                self._lines.append((arrival, bytes(self._incoming[:end])))
+                del self._incoming[:end]
+            self._lock.notify_all()
+        return len(data)
+
+    def read(self, size=1):
+        """Read up to size bytes, blocking until they arrive or timeout.
+
+        Parameters:
+            size (int): Number of bytes to read.
+        Returns:
+            (bytes): The bytes read, possibly fewer than size on timeout.
+        """
+        return self._read(lambda buffer: size if len(buffer) >= size else None)
+
+    def read_until(self, expected=b"\n", size=None):
+        """Read until the expected sequence is found, size is hit or timeout.
+
+        Parameters:
+            expected (bytes): Terminating byte sequence.
+            size (int): Optional maximum number of bytes to read.
+        Returns:
+            (bytes): The bytes read including the terminator.
+        """
+        def ready(buffer):
+            index = buffer.find(expected)
+            if index >= 0:
+                return index + len(expected)
+            if size is not None and len(buffer) >= size:
+                return size
+            return None
+        return self._read(ready)
+
+    def flush(self):
+        """Wait until all written data has been transmitted."""
+        delay = self._rx_free_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def reset_input_buffer(self):
+        """Discard all bytes that have already arrived at the host."""
+        with self._lock:
+            self._collect()
+            self._buffer.clear()
+
+    def close(self):
+        """Close the emulated port and stop the device thread."""
+        with self._lock:
+            self.is_open = False
+            self._lock.notify_all()
+        self._thread.join(timeout=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _collect(self):
+        """Move bytes whose transfer has finished into the read buffer."""
+        now = time.monotonic()
+        while self._outgoing and self._outgoing[0][0] <= now:
+            self._buffer += self._outgoing.popleft()[1]
+
+    def _read(self, ready):
+        """Block until ready(buffer) returns a byte count or timeout.
+
+        Raises:
+            IOError: when the port is closed, before or while waiting, like
+                pyserial does.
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._lock:
+            while True:
+                if not self.is_open:
+                    raise IOError("Emulated port is closed.")
+                self._collect()
+                count = ready(self._buffer)
+                now = time.monotonic()
+                if count is None and deadline is not None and now >= deadline:
+                    count = len(self._buffer)
+                if count is not None:
+                    data = bytes(self._buffer[:count])
+                    del self._buffer[:count]
+                    self.bytes_read += len(data)
+                    return data
+                wait = None if deadline is None else deadline - now
+                if self._outgoing:
+                    arrival = self._outgoing[0][0] - now
+                    wait = arrival if wait is None else min(wait, arrival)
+                self._lock.wait(wait)
+
+    def _send(self, data):
+        """Queue bytes from the device to the host with their transfer delay."""
+        with self._lock:
+            now = time.monotonic()
+            self._tx_free_at = max(now, self._tx_free_at) + len(data) * self.byte_time
+            arrival = self._tx_free_at + self.link_latency
+            self._outgoing.append((arrival, data))
+            self._lock.notify_all()
+            return arrival
+
+    def _send_message(self, message_type, message_data):
+        """Send a line the same way sendMessage does in the firmware."""
+        return self._send(bytes(f"{message_type}{message_data}\r\n", "utf-8"))
+
+    def _run(self):
+        """Device loop, the equivalent of loop() in the firmware."""
+        while True:
+            with self._lock:
+                while self.is_open and not self._lines:
+                    self._lock.wait()
+                if not self.is_open:
+                    return
+                arrival, line = self._lines.popleft()
+            delay = arrival - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if arrival < self._booted_at:
+                continue
+            # Like the firmware, drop what does not fit into the message buffer.
+            message = line.decode("utf-8", errors="replace").rstrip("\r\n")
+            self._analyze_message(message[:Communication.MAX_MESSAGE_LENGTH])
+
+    def _analyze_message(self, message):
+        """Decode a message and answer it like analyzeMessage."""
+        if not message:
+            return
+        message_type = message[0]
+        data, separator, tag = message[1:].partition("#")
+        tag = separator + tag.strip()
+        if message_type == "M":
+            self._send_message("M", self._respond_servo_message(data) + tag)
+        elif message_type == "S":
+            if data.startswith("BIN") and self.protocol_version >= 1:
+                sequence = int(tag[1:]) if tag[1:].isdigit() else None
+                done = self._send(Communication.encode_frame("S", self._sample(), sequence))
+            else:
+                done = self._send_message("S", self._respond_sensor_message(data) + tag)
+            self.measurement_times.append(done)
+        elif message_type == "T":
+            self._send_message("T", self._respond_test_message(data) + tag)
+        elif message_type == "R" and self.protocol_version >= 2:
+            self._send_message("R", self._respond_scan_line_message(data, tag) + tag)
+
+    def _respond_test_message(self, data):
+        """Answer the handshake and agree on a protocol version."""
+        requested = data[len("12345V"):]
+        if self.protocol_version < 1 or not requested.isdigit():
+            return "12345"
+        return f"12345V{min(int(requested), self.protocol_version)}"
+
+    def _respond_scan_line_message(self, data, tag):
+        """Move to, settle at and measure every target of a scan line.
+
+        Every measurement is streamed back as a binary P frame.
+
+        Returns:
+            (str): Number of points measured.
+        """
+        sequence = int(tag[1:]) if tag[1:].isdigit() else None
+        targets = data.split(",") if data else []
+        for count, target in enumerate(targets):
+            if self._respond_servo_message(target) == "0":
+                return str(count)
+            settle = target.partition("@")[2]
+            time.sleep(int(settle) / 100 if settle.isdigit() else self.settle_time)
+            done = self._send(Communication.encode_frame("P", self._sample(), sequence))
+            self.measurement_times.append(done)
+        return str(len(targets))
+
+    def _respond_servo_message(self, data):
+        """Move the servos and report the wait time in tenths of a second."""
+        try:
+            pitch = int(data[0:3])
+            yaw = int(data[4:7])
+        except ValueError:
+            return "0"
+        self._previous = self._current_position()
+        step = max(abs(pitch - self._previous[0]), abs(yaw - self._previous[1]))
+        self._pitch = pitch
+        self._yaw = yaw
+        self._settled_at = time.monotonic() + self.servo_damping + step / self.servo_speed
+        return str(max(1, int(np.ceil(self.settle_time * 10))))
+
+    def _respond_sensor_message(self, data):
+        """Sample the ADC and format the readings as comma separated text."""
+        return ",".join(str(value) for value in self._sample())
+
+    def _current_position(self):
+        """Servo position, the previous target while still settling."""
+        if time.monotonic() < self._settled_at:
+            return self._previous
+        return (self._pitch, self._yaw)
+
+    def _sample(self):
+        """Read the emulated distance sensor.
+
+        Returns:
+            (numpy.ndarray): Raw 10-bit ADC readings.
+        """
+        pitch_servo, yaw_servo = self._current_position()
+        distance = self.scene(pitch_servo - 150, 90 - yaw_servo)
+        readings = distance_to_adc(distance) + self._rng.normal(0, self.adc_noise, self.samples)
+        if self.sample_time:
+            time.sleep(self.sample_time * self.samples)
+        return np.clip(np.rint(readings), 0, 1023).astype(int)
+
+
+def fast_planner():
+    """Planner with the short settle times the emulated servos need.
+
+    Returns:
+        (PathPlanner): Serpentine planner for quick scans of an EmulatedArduino.
+    """
+    return PathPlanner(min_settle=0.03, seconds_per_degree=0.002, max_settle=0.2)
+
+
+@contextmanager
+def fast_scanner(instrumentation=None, **kwargs):
+    """Connect a Scanner with a fast_planner to a noise free EmulatedArduino.
+
+    Parameters:
+        instrumentation (Instrumentation): Passed on to the Scanner.
+        **kwargs: Passed on to EmulatedArduino, e.g. scene or protocol_version.
+    Yields:
+        (Scanner): The connected scanner. The emulator is closed afterwards.
+    """
+    kwargs = {"adc_noise": 0, "seed": 0, **kwargs}
+    with EmulatedArduino(**kwargs) as device:
+        yield Scanner(
+            comms=Communication(port=device),
+            planner=fast_planner(),
+            instrumentation=instrumentation,
+        )
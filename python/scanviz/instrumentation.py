@@ -0,0 +1,212 @@
+import json
+import logging
+import logging.config
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class Instrumentation():
+    """Time the phases of every point of a scan and count errors.
+
+    The phases are "write" (sending a command), "wait" (until the first byte
+    of the response arrives, which covers the device's work), "read" (reading
+    and parsing the rest of the response), "calibrate" (converting readings
+    into inches) and "settle" (waiting on the host for the servos). With the
+    scan line command the servos settle on the device, so that time is part
+    of "wait".
+
+    A disabled Instrumentation, the default everywhere, only costs a method
+    call per phase.
+    """
+
+    PHASES = ["write", "wait", "read", "calibrate", "settle"]
+    PERCENTILES = [50, 90, 99]
+    # Histogram bin edges in seconds, two bins per decade from 10 us to 10 s.
+    HISTOGRAM_BINS = np.logspace(-5, 1, 13)
+
+    def __init__(self, enabled=True, trace_path=None, max_events=100000):
+        """Instantiate an Instrumentation object.
+
+        Parameters:
+            enabled (bool): Record timings and counters.
+            trace_path (str): Optional Chrome trace file written after every
+                scan. Open it in chrome://tracing or Perfetto.
+            max_events (int): Number of most recent timings kept.
+        """
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self.events = deque(maxlen=max_events)
+        self.counters = {}
+        self.last_summary = None
+        self._counter_lock = threading.Lock()
+        self._null = nullcontext()
+        self._origin = time.perf_counter()
+
+    def span(self, phase):
+        """Time a phase.
+
+        Parameters:
+            phase (str): Name of the phase, usually one of PHASES.
+        Returns:
+            (context manager): Records the time spent inside the with block.
+        """
+        if not self.enabled:
+            return self._null
+        return _Span(self.events, phase)
+
+    def count(self, name, value=1):
+        """Increase a counter, e.g. of errors or retries.
+
+        Parameters:
+            name (str): Name of the counter.
+            value (int): Amount to add.
+        """
+        if not self.enabled:
+            return
+        with self._counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        """Forget all timings and counters."""
+        self.events.clear()
+        with self._counter_lock:
+            self.counters = {}
+
+    def durations(self, phase):
+        """Recorded durations of a phase.
+
+        Parameters:
+            phase (str): Name of the phase.
+        Returns:
+            (numpy.ndarray): Durations in seconds, oldest first.
+        """
+        return np.array([event[2] for event in list(self.events) if event[0] == phase])
+
+    def histogram(self, phase):
+        """Latency histogram of a phase.
+
+        Parameters:
+            phase (str): Name of the phase.
+        Returns:
+            (numpy.ndarray): Number of durations in each bin.
+            (numpy.ndarray): Bin edges in seconds, see HISTOGRAM_BINS. Durations
+                outside the edges are counted in the first or last bin.
+        """
+        durations = np.clip(self.durations(phase), self.HISTOGRAM_BINS[0], self.HISTOGRAM_BINS[-1])
+        counts, edges = np.histogram(durations, bins=self.HISTOGRAM_BINS)
+        return counts, edges
+
+    def summary(self):
+        """Summarize the recorded timings and counters.
+
+        Returns:
+            (dict): "phases" maps every recorded phase to its "count", "total",
+                "mean", percentiles such as "p50", "max" and "histogram" in
+                seconds, "counters" holds the counters.
+        """
+        phases = {}
+        recorded = {event[0] for event in list(self.events)}
+        for phase in self.PHASES + sorted(recorded - set(self.PHASES)):
+            durations = self.durations(phase)
+            if not len(durations):
+                continue
+            phases[phase] = {
+                "count": len(durations),
+                "total": float(durations.sum()),
+                "mean": float(durations.mean()),
+                "max": float(durations.max()),
+                "histogram": self.histogram(phase)[0].tolist(),
+            }
+            for percentile in self.PERCENTILES:
+                phases[phase][f"p{percentile}"] = float(np.percentile(durations, percentile))
+        with self._counter_lock:
+            counters = dict(self.counters)
+        return {"phases": phases, "counters": counters}
+
+    def report(self):
+        """Format the summary as a table.
+
+        Returns:
+            (str): Human readable table, one row per phase, then the counters.
+        """
+        summary = self.summary()
+        header = (
+            f"{'phase':>10} {'count':>7} {'total s':>8} {'mean ms':>8}"
+            + "".join(f" {'p' + str(p) + ' ms':>9}" for p in self.PERCENTILES)
+            + f" {'max ms':>9}"
+        )
+        lines = [header]
+        for phase, stats in summary["phases"].items():
+            lines += [
+                f"{phase:>10} {stats['count']:>7} {stats['total']:>8.2f}"
+                f" {stats['mean'] * 1000:>8.2f}"
+                + "".join(f" {stats[f'p{p}'] * 1000:>9.2f}" for p in self.PERCENTILES)
+                + f" {stats['max'] * 1000:>9.2f}"
+            ]
+        lines += [f"{name}: {value}" for name, value in sorted(summary["counters"].items())]
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        """Write the recorded timings as a Chrome trace.
+
+        Parameters:
+            path (str): Path of the JSON trace file.
+        """
+        pid = os.getpid()
+        events = [
+            {
+                "name": phase,
+                "cat": "scanviz",
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": thread,
+            }
+            for phase, start, duration, thread in list(self.events)
+        ]
+        with self._counter_lock:
+            counters = dict(self.counters)
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": events, "otherData": counters}, trace_file)
+
+    def scan_finished(self):
+        """Log the summary, write the trace file and reset, called after every scan.
+
+        The summary of the finished scan stays available as last_summary.
+        """
+        if not self.enabled:
+            return
+        self.last_summary = self.summary()
+        logger.info("Scan timings:\n%s", self.report())
+        if self.trace_path is not None:
+            self.export_chrome_trace(self.trace_path)
+            logger.info("Wrote scan trace to %s", self.trace_path)
+        self.reset()
+
+
+class _Span():
+    """Context manager appending (phase, start, duration, thread) to events."""
+
+    def __init__(self, events, phase):
+        self.events = events
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.events.append(
+            (self.phase, self.start, time.perf_counter() - self.start, threading.get_ident())
+        )
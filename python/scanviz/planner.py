@@ -0,0 +1,129 @@
+import logging
+import logging.config
+import os
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class PathPlanner():
+    """Order the points of a scan and estimate how long the servos need."""
+
+    ORDERS = ["raster", "serpentine", "spiral", "nearest"]
+
+    def __init__(
+        self,
+        order="serpentine",
+        min_settle=0.1,
+        seconds_per_degree=0.005,
+        max_settle=1.5,
+        point_time=0.02,
+    ):
+        """Instantiate a PathPlanner object.
+
+        The servos move at the same time, so the settle time of a move grows
+        with the larger of the pitch and yaw steps.
+
+        Parameters:
+            order (str): Visiting order, one of ORDERS.
+            min_settle (float): Seconds to wait after even the smallest move.
+            seconds_per_degree (float): Extra seconds to wait per degree moved.
+            max_settle (float): Upper limit of the settle time. This is also used
+                for the first move since the start position is unknown.
+            point_time (float): Seconds spent measuring and communicating per
+                point, used for the time estimate.
+        """
+        if order not in self.ORDERS:
+            raise ValueError(f"Unknown scan order: {order}")
+        self.order = order
+        self.min_settle = min_settle
+        self.seconds_per_degree = seconds_per_degree
+        self.max_settle = max_settle
+        self.point_time = point_time
+
+    def plan(self, pitch_mesh, yaw_mesh):
+        """Plan a scan of a mesh.
+
+        Serpentine and spiral orders need a 2D mesh. Scattered points, passed as
+        1D arrays, are visited in nearest neighbour order instead.
+
+        Parameters:
+            pitch_mesh (numpy.ndarray): Pitch angle of every point.
+            yaw_mesh (numpy.ndarray): Yaw angle of every point.
+        Returns:
+            (dict): "order" holds the flat mesh indices in visiting order,
+                "settle_times" the seconds to wait after moving to each of
+                them and "estimated_time" the expected duration in seconds.
+        """
+        pitch_mesh = np.asarray(pitch_mesh)
+        yaw_mesh = np.asarray(yaw_mesh)
+        order = self.order
+        if pitch_mesh.ndim != 2 and order in ["serpentine", "spiral"]:
+            # Without a grid there are no rows to follow.
+            order = "nearest"
+        if order == "raster":
+            order = np.arange(pitch_mesh.size)
+        elif order == "serpentine":
+            order = self._serpentine(pitch_mesh.shape)
+        elif order == "spiral":
+            order = self._spiral(pitch_mesh.shape)
+        else:
+            order = self._nearest(np.ravel(pitch_mesh), np.ravel(yaw_mesh))
+        settle_times = self.settle_times(
+            np.ravel(pitch_mesh)[order], np.ravel(yaw_mesh)[order]
+        )
+        return {
+            "order": order,
+            "settle_times": settle_times,
+            "estimated_time": float(settle_times.sum() + self.point_time * len(order)),
+        }
+
+    def settle_times(self, pitches, yaws):
+        """Settle time after each move of a path.
+
+        Parameters:
+            pitches (numpy.ndarray): Pitch angles in visiting order.
+            yaws (numpy.ndarray): Yaw angles in visiting order.
+        Returns:
+            (numpy.ndarray): Seconds to wait after moving to each point.
+        """
+        steps = np.maximum(
+            np.abs(np.diff(pitches, prepend=np.nan)),
+            np.abs(np.diff(yaws, prepend=np.nan)),
+        )
+        settle_times = self.min_settle + self.seconds_per_degree * steps
+        settle_times[np.isnan(settle_times)] = self.max_settle
+        return np.minimum(settle_times, self.max_settle)
+
+    def _serpentine(self, shape):
+        """Visit rows alternately left to right and right to left."""
+        order = np.arange(np.prod(shape)).reshape(shape)
+        order[1::2] = order[1::2, ::-1]
+        return np.ravel(order)
+
+    def _spiral(self, shape):
+        """Visit the outer ring of the mesh first and spiral inwards."""
+        grid = np.arange(np.prod(shape)).reshape(shape)
+        order = []
+        while grid.size:
+            order += list(grid[0])
+            grid = np.rot90(grid[1:])
+        return np.array(order, dtype=int)
+
+    def _nearest(self, pitches, yaws):
+        """Always move to the closest point that has not been visited yet."""
+        points = np.column_stack([pitches, yaws]).astype(float)
+        visited = np.zeros(len(points), dtype=bool)
+        order = np.empty(len(points), dtype=int)
+        current = 0
+        for index in range(len(points)):
+            order[index] = current
+            visited[current] = True
+            steps = np.max(np.abs(points - points[current]), axis=1)
+            steps[visited] = np.inf
+            current = int(np.argmin(steps))
+        return order
@@ -0,0 +1,216 @@
+import logging
+import logging.config
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from scanviz.communication import Communication
+from scanviz.instrumentation import Instrumentation
+from scanviz.scanner import Scanner
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class ScannerPool():
+    """Split scans across several scanners that measure at the same time.
+
+    The points of a scan are cut into blocks of rows that are put on a job
+    queue. Every scanner has a worker thread taking blocks from the queue, so
+    faster scanners simply measure more blocks. When a scanner fails, the
+    points of its block it did not measure go back on the queue and the
+    remaining scanners finish the scan.
+    """
+
+    def __init__(
+        self, ports=None, baudrate=115200, planner=None, calibration=None, instrumentation=None
+    ):
+        """Connect to every scanner in parallel.
+
+        Connecting to an Arduino takes a few seconds, so the connections are
+        opened at the same time. Ports that fail to connect are skipped.
+
+        Parameters:
+            ports (list): Serial ports or pyserial-compatible objects, such as
+                EmulatedArduinos. All discovered Arduinos are used by default.
+            baudrate (int): Baudrate of the serial ports.
+            planner (PathPlanner): Plans the path of every block, shared by all
+                scanners.
+            calibration (Calibration): Converts readings into inches, shared by
+                all scanners.
+            instrumentation (Instrumentation): Counts the points requeued from
+                failed scanners and reports after each sweep. Every scanner
+                keeps its own instrumentation for its timings.
+        """
+        self.instrumentation = (
+            instrumentation if instrumentation is not None else Instrumentation(enabled=False)
+        )
+        if ports is None:
+            ports = Communication.discover_ports()
+            if not ports:
+                raise IOError("No Arduino found.")
+        with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+            futures = [
+                executor.submit(
+                    lambda port: Scanner(
+                        comms=Communication(baudrate=baudrate, port=port),
+                        planner=planner,
+                        calibration=calibration,
+                    ),
+                    port,
+                )
+                for port in ports
+            ]
+        self.scanners = []
+        for port, future in zip(ports, futures):
+            try:
+                self.scanners.append(future.result())
+            except Exception as error:
+                logger.warning(f"Could not connect to {port}: {error}")
+        if not self.scanners:
+            raise IOError("Could not connect to any scanner.")
+        logger.info(f"Scanner pool ready with {len(self.scanners)} scanners.")
+
+    def sweep(self, resolution, visualize=True, image_path=None):
+        """Sweep over the scan mesh with all scanners, see Scanner.sweep.
+
+        Parameters:
+            resolution (int): Resolution of the scan mesh.
+            visualize (bool): Plot the scan once it is complete.
+            image_path (str): Save the plot to this image file instead of
+                showing it.
+        Returns:
+            (numpy.ndarray): Measured distances with the shape of the scan mesh.
+        """
+        viz = self.scanners[0].viz
+        pitch_mesh, yaw_mesh = viz.generate_mesh(resolution)
+        radius_mesh = np.empty(np.shape(pitch_mesh))
+        scanners = list(self.scanners)
+        try:
+            for point in self.iter_points(pitch_mesh, yaw_mesh):
+                radius_mesh.flat[point["index"]] = point["distance"]
+        finally:
+            for scanner in scanners:
+                scanner.instrumentation.scan_finished()
+            self.instrumentation.scan_finished()
+        if visualize:
+            viz.create_viz(pitch_mesh, yaw_mesh, radius_mesh, path=image_path)
+        return radius_mesh
+
+    def iter_points(self, pitches, yaws, blocks=None, buffer_size=64):
+        """Measure a set of points with all scanners and yield them as they arrive.
+
+        Parameters:
+            pitches (numpy.ndarray): Pitch angle of every point.
+            yaws (numpy.ndarray): Yaw angle of every point, same shape as pitches.
+            blocks (int): Number of blocks the points are cut into. Defaults to
+                two per scanner, small enough to balance the load and large
+                enough for the planner to find a short path through each.
+            buffer_size (int): Number of measured points that may wait for the
+                consumer before acquisition pauses.
+        Yields:
+            (dict): Measured point, see Scanner.iter_points. The index refers to
+                the flattened pitches.
+
+        Raises:
+            IOError: Every scanner failed before the scan was complete.
+        """
+        pitches = np.ravel(pitches).reshape(np.shape(pitches))
+        yaws = np.ravel(yaws).reshape(np.shape(yaws))
+        indices = np.arange(pitches.size).reshape(pitches.shape)
+        if blocks is None:
+            blocks = 2 * len(self.scanners)
+        jobs = queue.Queue()
+        for block in np.array_split(indices, blocks):
+            if block.size:
+                jobs.put(block)
+        points = queue.Queue(maxsize=buffer_size)
+        stop = threading.Event()
+        failed = []
+        workers = [
+            threading.Thread(
+                target=self._work,
+                args=(scanner, pitches, yaws, jobs, points, stop, failed),
+                daemon=True,
+            )
+            for scanner in self.scanners
+        ]
+        for worker in workers:
+            worker.start()
+        received = 0
+        try:
+            while received < pitches.size:
+                point = points.get()
+                if isinstance(point, Exception):
+                    if len(failed) == len(self.scanners):
+                        raise IOError("Every scanner in the pool failed.") from point
+                    continue
+                received += 1
+                yield point
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+            if failed:
+                self.scanners = [scanner for scanner in self.scanners if scanner not in failed]
+                logger.warning(f"Removed {len(failed)} failed scanners from the pool.")
+
+    def _work(self, scanner, pitches, yaws, jobs, points, stop, failed):
+        """Measure blocks from the job queue with one scanner, run by a worker thread.
+
+        Measured points are put on the points queue. When the scanner fails the
+        unmeasured rest of its block is requeued, the scanner is added to failed
+        and the exception is put on the points queue.
+        """
+        def put(item):
+            while not stop.is_set():
+                try:
+                    points.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        while not stop.is_set():
+            try:
+                block = jobs.get(timeout=0.1)
+            except queue.Empty:
+                # Another scanner may still fail and requeue its points.
+                continue
+            measured = np.zeros(block.shape, dtype=bool)
+            block_points = scanner.iter_points(pitches.flat[block], yaws.flat[block])
+            try:
+                for point in block_points:
+                    measured.flat[point["index"]] = True
+                    point["index"] = int(block.flat[point["index"]])
+                    if not put(point):
+                        block_points.close()
+                        return
+            except Exception as error:
+                remaining = block[~measured]
+                if remaining.size:
+                    jobs.put(remaining)
+                    self.instrumentation.count("requeued_points", remaining.size)
+                logger.warning(f"Scanner failed, requeued {remaining.size} points: {error}")
+                failed.append(scanner)
+                put(error)
+                return
+
+    def close(self):
+        """Close the serial ports of all scanners."""
+        for scanner in self.scanners:
+            try:
+                scanner.comms.close()
+            except Exception as error:
+                logger.warning(f"Could not close scanner: {error}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -2,9 +2,15 @@ import time
 import logging
 import logging.config
 import os
+import queue
+import threading
 
 import numpy as np
+from scanviz.adaptive import AdaptiveSweep
+from scanviz.calibration import Calibration
 from scanviz.communication import Communication
+from scanviz.planner import PathPlanner
+from scanviz.storage import ScanReader, ScanWriter
 from scanviz.visualization import Visualization
 
 logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
@@ -15,63 +21,465 @@ logger.setLevel(logging.DEBUG)
 class Scanner():
     """API for interfacing with the scanner"""
 
-    def __init__(self):
-        self.comms = Communication()
+    def __init__(self, comms=None, planner=None, calibration=None, instrumentation=None):
+        """Instantiate a Scanner object.
+
+        Parameters:
+            comms (Communication): Link to the scanner. When omitted a connection
+                to the first Arduino found is opened.
+            planner (PathPlanner): Orders the points of a sweep and picks their
+                settle times. Scans wait as long as the planner says, the wait
+                time the firmware reports (waitTime) is not used. Defaults to a
+                serpentine PathPlanner.
+            calibration (Calibration): Converts raw sensor readings into inches.
+                Defaults to the stock sensor curve.
+            instrumentation (Instrumentation): Times every phase of a scan and
+                reports after each scan. Replaces the instrumentation of comms,
+                which is disabled by default.
+        """
+        self.comms = comms if comms is not None else Communication()
+        if instrumentation is not None:
+            self.comms.instrumentation = instrumentation
+        self.instrumentation = self.comms.instrumentation
+        self.planner = planner if planner is not None else PathPlanner()
+        self.calibration = calibration if calibration is not None else Calibration()
         self.viz = Visualization()
 
-    def set_position(self, pitch, yaw):
+    def set_position(self, pitch, yaw, settle_time=None):
         """Send a message to the Arduino to set the pitch and roll of the Scanner.
 
         Parameters:
             pitch (float): Representing the desired pitch angle.
             yaw (float): Representing the desired yaw angle.
+            settle_time (float): Seconds to wait for the servos. Defaults to the
+                wait time requested by the Arduino.
+        """
+        message = self._position_message(pitch, yaw)
+        response = self.comms.send_recieve("M", message)
+        self._wait_for_servo(response, settle_time)
+
+    def get_distance(self):
+        """Send a message to Arduino to send three distance measurements over serial.
+
+        Returns:
+            (float): Calibrated output from distance sensor in inches.
+        """
+        logger.debug("Getting measured sensor distance.")
+        response = self.comms.send_recieve("S", self._sensor_request())
+        return self._parse_distance(response)
+
+    def scan_line(self, pitches, yaws, settle_times=None):
+        """Move to and measure a list of targets with a single scan line message.
+
+        The Arduino settles at every target on its own and streams the readings
+        back, so no time is spent waiting on the host between points. Requires
+        protocol version 2.
+
+        Parameters:
+            pitches (list): Pitch angle of every target.
+            yaws (list): Yaw angle of every target.
+            settle_times (list): Seconds to settle at every target. Defaults to
+                the fixed wait time of the Arduino.
+        Returns:
+            (numpy.ndarray): Measured distance at every target.
+        """
+        samples = np.stack(list(self._stream_line(pitches, yaws, settle_times)))
+        with self.instrumentation.span("calibrate"):
+            return self.calibration.distance(samples)
+
+    def _stream_line(self, pitches, yaws, settle_times=None):
+        """Send scan line messages and yield the readings as they arrive.
+
+        The Arduino only keeps MAX_MESSAGE_LENGTH bytes of a message, so long
+        lines are sent as several messages.
+
+        Parameters:
+            pitches (list): Pitch angle of every target.
+            yaws (list): Yaw angle of every target.
+            settle_times (list): Seconds to settle at every target.
+        Yields:
+            (numpy.ndarray): Raw ADC readings of every target.
+        """
+        targets = [self._position_message(pitch, yaw) for pitch, yaw in zip(pitches, yaws)]
+        if settle_times is not None:
+            # Settle times travel in hundredths of a second.
+            targets = [
+                f"{target}@{int(np.clip(round(settle * 100), 0, 999)):03d}"
+                for target, settle in zip(targets, settle_times)
+            ]
+        # Leave room for the message type and the longest sequence tag.
+        room = (
+            self.comms.MAX_MESSAGE_LENGTH
+            - 1
+            - len(f"{self.comms.TAG}{self.comms.MAX_SEQUENCE - 1}")
+        )
+        message = []
+        length = -1
+        for target in targets:
+            if message and length + 1 + len(target) > room:
+                yield from self._stream_message(message)
+                message = []
+                length = -1
+            message += [target]
+            length += 1 + len(target)
+        if message:
+            yield from self._stream_message(message)
+
+    def _stream_message(self, targets):
+        """Send a single scan line message and yield the readings as they arrive.
+
+        The whole response is always read, even if the generator is closed
+        early, so the link stays in sync.
+
+        Parameters:
+            targets (list): Targets formatted for the Arduino.
+        Yields:
+            (numpy.ndarray): Raw ADC readings of every target.
+        """
+        stream = self.comms.send_stream("R", ",".join(targets), "P")
+        count = 0
+        try:
+            for response in stream:
+                count += 1
+                yield self._parse_samples(response)
+        finally:
+            for _ in stream:
+                count += 1
+        if count != len(targets):
+            self.instrumentation.count("servo_failures")
+            raise ValueError("Servo did not respond. Stopping program.")
+
+    def _position_message(self, pitch, yaw):
+        """Build the data of a servo message.
+
+        Parameters:
+            pitch (float): Representing the desired pitch angle.
+            yaw (float): Representing the desired yaw angle.
+        Returns:
+            (str): Servo angles formatted for the Arduino.
         """
         adjusted_pitch = pitch + 150
         adjusted_yaw = -yaw + 90
         if adjusted_pitch > 180 or adjusted_yaw > 180:
             raise ValueError("Cannot send motor angles greater than 180 deg.")
         logger.debug(
-            "Setting servo positions to (pitch)"
-            f" {int(round(adjusted_pitch))}, (yaw) {int(round(adjusted_yaw))}."
+            "Setting servo positions to (pitch) %d, (yaw) %d.",
+            round(adjusted_pitch),
+            round(adjusted_yaw),
         )
-        message = f"{int(round(adjusted_pitch)):03d}+{int(round(adjusted_yaw)):03d}"
-        response = self.comms.send_recieve("M", message)
+        return f"{int(round(adjusted_pitch)):03d}+{int(round(adjusted_yaw)):03d}"
+
+    def _wait_for_servo(self, response, settle_time=None):
+        """Wait for the servos to settle after a servo message.
+
+        Parameters:
+            response (dict): Response to a servo message.
+            settle_time (float): Seconds to wait. Defaults to the wait time the
+                Arduino asked for.
+        """
         if int(response["data"]) == 0:
+            self.instrumentation.count("servo_failures")
             raise ValueError("Servo did not respond. Stopping program.")
-        else:
-            time.sleep(int(response["data"])/10)
+        with self.instrumentation.span("settle"):
+            if settle_time is not None:
+                time.sleep(settle_time)
+            else:
+                time.sleep(int(response["data"])/10)
         logger.debug("Servo positions have been set.")
 
-    def get_distance(self):
-        """Send a message to Arduino to send three distance measurements over serial.
+    def _sensor_request(self):
+        """Data of a sensor message, asking for binary frames when supported.
+
+        Returns:
+            (str): "BIN" on protocol version 1 and newer, "GET" otherwise.
+        """
+        return "BIN" if self.comms.protocol_version >= 1 else "GET"
+
+    def _parse_samples(self, response):
+        """Extract the raw readings from the response to a sensor message.
+
+        Parameters:
+            response (dict): Response to a sensor message.
+        Returns:
+            (numpy.ndarray): Raw ADC readings.
+        """
+        logger.debug("Information recieved: %s", response["data"])
+        raw_data = response["data"]
+        if isinstance(raw_data, str):
+            raw_data = raw_data.split(",")
+        return np.asarray(raw_data, dtype=int)
+
+    def _parse_distance(self, response):
+        """Convert the response to a sensor message into a distance.
 
+        Parameters:
+            response (dict): Response to a sensor message.
         Returns:
             (float): Calibrated output from distance sensor in inches.
         """
-        logger.debug("Getting measured sensor distance.")
-        response = self.comms.send_recieve("S", "GET")
-        logger.debug(f"Information recieved: {response['data']}")
-        raw_data = response["data"].split(",")
-        output = []
-        for data in raw_data:
-            output += [48.7 - (0.15 * int(data)) + (0.000134 * (int(data)**2))]
-        logger.debug(f"Measured Value: {sum(output)/len(output)}")
-        return sum(output)/len(output)
-
-    def sweep(self, resolution):
+        samples = self._parse_samples(response)
+        with self.instrumentation.span("calibrate"):
+            distance = float(self.calibration.distance(samples))
+        logger.debug("Measured Value: %s", distance)
+        return distance
+
+    def sweep(self, resolution, visualize=True, path=None, image_path=None, live=None):
         """Sweep over a set of pitch and yaw values and collect distance data.
-        
+
+        The planner picks the settle time of every point, see Scanner.
+
         Parameters:
             resolution (int): Determines the number of measurements taken by the
                 sensor. The number of measurements equals (2*(resolution**2)).
+            visualize (bool): Plot the scan once it is complete.
+            path (str): Optional scan file that raw readings are saved to while
+                scanning. If the file already exists the scan resumes after the
+                last point stored in it.
+            image_path (str): Save the plot to this image file instead of
+                showing it, for scanners without a display.
+            live (LivePlot): Optional plot updated while points stream in.
+        Returns:
+            (numpy.ndarray): Measured distances with the shape of the scan mesh.
+        """
+        pitch_mesh, yaw_mesh = self.viz.generate_mesh(resolution)
+        try:
+            if path is not None:
+                radius_mesh = self._record(pitch_mesh, yaw_mesh, path, live=live)
+            else:
+                radius_mesh = np.empty(np.shape(pitch_mesh))
+                points = self.iter_points(pitch_mesh, yaw_mesh)
+                if live is not None:
+                    points = live.consume(points)
+                for point in points:
+                    radius_mesh.flat[point["index"]] = point["distance"]
+        finally:
+            self.instrumentation.scan_finished()
+        if visualize:
+            self.viz.create_viz(pitch_mesh, yaw_mesh, radius_mesh, path=image_path)
+        return radius_mesh
+
+    def adaptive_sweep(self, visualize=True, image_path=None, **kwargs):
+        """Scan coarse to fine, refining only where the range changes quickly.
+
+        Parameters:
+            visualize (bool): Plot the scan once it is complete.
+            image_path (str): Save the plot to this image file instead of
+                showing it.
+            **kwargs: Passed on to AdaptiveSweep, e.g. max_points or threshold.
+        Returns:
+            (numpy.ndarray): Pitch angle of every measured point.
+            (numpy.ndarray): Yaw angle of every measured point.
+            (numpy.ndarray): Measured distance of every point.
+        """
+        try:
+            pitches, yaws, radius = AdaptiveSweep(self, **kwargs).run()
+        finally:
+            self.instrumentation.scan_finished()
+        if visualize:
+            self.viz.create_viz(pitches, yaws, radius, path=image_path)
+        return pitches, yaws, radius
+
+    def record(self, pitches, yaws, path, buffer_size=64, live=None):
+        """Measure a set of points into a scan file, resuming an existing one.
+
+        Points are written in chunks while the scan runs, so after a crash
+        calling record again with the same path only measures the points that
+        are missing.
+
+        Parameters:
+            pitches (numpy.ndarray): Pitch angle of every point.
+            yaws (numpy.ndarray): Yaw angle of every point, same shape as pitches.
+            path (str): Path of the scan file.
+            buffer_size (int): Number of measured points that may wait for the
+                consumer before acquisition pauses.
+            live (LivePlot): Optional plot updated while points stream in.
+        Returns:
+            (numpy.ndarray): Measured distances with the shape of pitches.
+        """
+        try:
+            return self._record(pitches, yaws, path, buffer_size, live)
+        finally:
+            self.instrumentation.scan_finished()
+
+    def _record(self, pitches, yaws, path, buffer_size=64, live=None):
+        """Measure a set of points into a scan file, see record.
+
+        Does not report the instrumentation, so that sweep reports once.
+        """
+        if os.path.exists(path):
+            writer = ScanWriter.resume(path)
+        else:
+            writer = ScanWriter(path, pitches, yaws)
+        try:
+            # Compare shapes first, scans of another resolution do not broadcast.
+            if not (
+                list(writer.header["shape"]) == list(np.shape(pitches))
+                and np.allclose(writer.pitches, np.ravel(pitches))
+                and np.allclose(writer.yaws, np.ravel(yaws))
+            ):
+                raise ValueError(f"Scan file {path} holds a different scan.")
+            remaining = writer.remaining()
+            if len(remaining) < np.size(pitches):
+                # Resuming leaves scattered points. A fresh scan keeps its mesh,
+                # so that the planner can follow its rows.
+                pitches, yaws = writer.pitches[remaining], writer.yaws[remaining]
+            if len(remaining):
+                points = self.iter_points(pitches, yaws, buffer_size)
+                if live is not None:
+                    points = live.consume(points)
+                for point in points:
+                    point["index"] = int(remaining[point["index"]])
+                    writer.append(point)
+        finally:
+            writer.close()
+        return ScanReader(path).radius(self.calibration)
+
+    def iter_sweep(self, resolution, buffer_size=64):
+        """Sweep over the scan mesh and yield points as they are measured.
+
+        Parameters:
+            resolution (int): Resolution of the scan mesh, see sweep.
+            buffer_size (int): Number of measured points that may wait for the
+                consumer before acquisition pauses.
+        Yields:
+            (dict): Measured point, see iter_points.
         """
-        logger.info(f"Scan Beginning. Estimated Time: {((resolution**2)*1.5)/60}")
         pitch_mesh, yaw_mesh = self.viz.generate_mesh(resolution)
-        radius_mesh = []
-        for row in range(len(pitch_mesh)):
-            radius_mesh_row = []
-            for col in range(len(pitch_mesh[row])):
-                self.set_position(pitch_mesh[row][col], yaw_mesh[row][col])
-                radius_mesh_row += [self.get_distance()]
-            radius_mesh += [radius_mesh_row]
-        self.viz.create_viz(pitch_mesh, yaw_mesh, radius_mesh)
\ No newline at end of file
+        return self.iter_points(pitch_mesh, yaw_mesh, buffer_size)
+
+    def iter_points(self, pitches, yaws, buffer_size=64):
+        """Measure a set of points and yield them as they arrive.
+
+        A reader thread owns the link to the Arduino and fills a bounded queue,
+        so whatever the consumer does with a point overlaps with measuring the
+        next ones. Points arrive in the order chosen by the planner. Closing the
+        generator early stops the scan after the point in progress. The
+        instrumentation is reported by the scan calling this, such as sweep.
+
+        Parameters:
+            pitches (numpy.ndarray): Pitch angle of every point.
+            yaws (numpy.ndarray): Yaw angle of every point, same shape as pitches.
+            buffer_size (int): Number of measured points that may wait for the
+                consumer before acquisition pauses.
+        Yields:
+            (dict): "index" is the flat index of the point in pitches, followed
+                by its "pitch", "yaw", raw "samples", calibrated "distance" and
+                the "timestamp" it was received at.
+        """
+        plan = self.planner.plan(pitches, yaws)
+        logger.info(f"Scan Beginning. Estimated Time: {plan['estimated_time']/60}")
+        line_length = np.shape(pitches)[-1]
+        points = queue.Queue(maxsize=buffer_size)
+        stop = threading.Event()
+        reader = threading.Thread(
+            target=self._read_points,
+            args=(
+                np.ravel(pitches),
+                np.ravel(yaws),
+                plan,
+                line_length,
+                points,
+                stop,
+            ),
+            daemon=True,
+        )
+        reader.start()
+        try:
+            while True:
+                point = points.get()
+                if point is None:
+                    return
+                if isinstance(point, Exception):
+                    raise point
+                with self.instrumentation.span("calibrate"):
+                    point["distance"] = float(self.calibration.distance(point["samples"]))
+                yield point
+        finally:
+            stop.set()
+            reader.join()
+
+    def _read_points(self, pitches, yaws, plan, line_length, points, stop):
+        """Measure planned points and put them on a queue, run by the reader thread.
+
+        The queue receives a dictionary per point, then None when done or the
+        exception that ended the scan.
+        """
+        def put(item):
+            while not stop.is_set():
+                try:
+                    points.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        order = plan["order"]
+        try:
+            acquisition = self._acquire(
+                pitches[order], yaws[order], plan["settle_times"], line_length
+            )
+            for position, samples in enumerate(acquisition):
+                index = int(order[position])
+                point = {
+                    "index": index,
+                    "pitch": float(pitches[index]),
+                    "yaw": float(yaws[index]),
+                    "samples": samples,
+                    "timestamp": time.time(),
+                }
+                if not put(point):
+                    acquisition.close()
+                    return
+            put(None)
+        except Exception as error:
+            put(error)
+
+    def _acquire(self, pitches, yaws, settle_times, line_length):
+        """Measure points in the given order with the fastest method available.
+
+        Parameters:
+            pitches (numpy.ndarray): Pitch angle of every point in visiting order.
+            yaws (numpy.ndarray): Yaw angle of every point in visiting order.
+            settle_times (numpy.ndarray): Seconds to settle at every point.
+            line_length (int): Points per scan line, usually a row of the mesh.
+        Yields:
+            (numpy.ndarray): Raw ADC readings of every point.
+        """
+        if self.comms.protocol_version >= 2:
+            for start in range(0, len(pitches), line_length):
+                yield from self._stream_line(
+                    pitches[start:start + line_length],
+                    yaws[start:start + line_length],
+                    settle_times[start:start + line_length],
+                )
+        elif self.comms.pipelined:
+            yield from self._acquire_pipelined(pitches, yaws, settle_times)
+        else:
+            for pitch, yaw, settle_time in zip(pitches, yaws, settle_times):
+                self.set_position(pitch, yaw, settle_time)
+                response = self.comms.send_recieve("S", self._sensor_request())
+                yield self._parse_samples(response)
+
+    def _acquire_pipelined(self, pitches, yaws, settle_times):
+        """Measure a path while overlapping round trips on a pipelined link.
+
+        The sensor message for a point and the servo message for the next point
+        are sent back to back. The Arduino handles them in order, so the reading
+        is taken before the servos move, and the link only waits once per point.
+
+        Parameters:
+            pitches (numpy.ndarray): Pitch angle of every point in visiting order.
+            yaws (numpy.ndarray): Yaw angle of every point in visiting order.
+            settle_times (numpy.ndarray): Seconds to settle at every point.
+        Yields:
+            (numpy.ndarray): Raw ADC readings of every point.
+        """
+        move = self.comms.send_async("M", self._position_message(pitches[0], yaws[0]))
+        for index in range(len(pitches)):
+            self._wait_for_servo(move.result(), settle_times[index])
+            measurement = self.comms.send_async("S", self._sensor_request())
+            if index + 1 < len(pitches):
+                move = self.comms.send_async(
+                    "M", self._position_message(pitches[index + 1], yaws[index + 1])
+                )
+            yield self._parse_samples(measurement.result())
@@ -0,0 +1,430 @@
+import json
+import logging
+import logging.config
+import os
+import queue
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Only the standard library is imported here, so clients start quickly. The
+# service imports the scanner once it connects.
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir()), "scanviz.sock"
+)
+
+
+class ScannerService():
+    """Keep a scanner connected and run scan jobs submitted over a Unix socket.
+
+    Connecting to the Arduino and importing the scanning stack only happens
+    once, when the service starts. Jobs are queued and run one after another
+    by a worker thread. When a job fails, the link is checked with a test
+    message. If the link is broken the service reconnects and runs the job
+    again, otherwise the job failed by itself and is not retried.
+
+    Every request is a single line of JSON with a "command", answered by a
+    single line of JSON holding the "response" to one of these commands:
+        submit: run "type", one of JOB_TYPES, with the keyword arguments in
+            "params". Answers the job "id".
+        status: the job with the given "id".
+        wait: the job with the given "id" once it is finished, or after
+            "timeout" seconds.
+        jobs: all jobs, without their results.
+        shutdown: stop the service.
+    Failed requests are answered with an "error" instead.
+    """
+
+    JOB_TYPES = ["sweep", "adaptive_sweep", "points"]
+
+    def __init__(
+        self,
+        socket_path=DEFAULT_SOCKET,
+        port=None,
+        baudrate=115200,
+        scanner_factory=None,
+        max_retries=1,
+        reconnect_delay=1.0,
+        instrumentation=None,
+    ):
+        """Instantiate a ScannerService object.
+
+        Parameters:
+            socket_path (str): Path of the Unix socket to listen on.
+            port (str): Serial port of the Arduino. It is found automatically
+                when omitted, trying the last working port first.
+            baudrate (int): Baudrate of the serial port.
+            scanner_factory (callable): Returns a connected Scanner, called on
+                every (re)connect. Defaults to a Scanner on port.
+            max_retries (int): Number of times a job is run again after the
+                link broke while running it.
+            reconnect_delay (float): Seconds to wait before the first reconnect
+                attempt, doubled after every failed attempt up to 30 seconds.
+            instrumentation (Instrumentation): Counts job reruns, reconnects
+                and failed connection attempts. The default scanner reports
+                them with its scan timings, pass the same instrumentation to
+                the scanners of scanner_factory to do the same. Disabled by
+                default.
+        """
+        if instrumentation is None:
+            from scanviz.instrumentation import Instrumentation
+            instrumentation = Instrumentation(enabled=False)
+        self.instrumentation = instrumentation
+        self.socket_path = socket_path
+        self.port = port
+        self.baudrate = baudrate
+        self.scanner_factory = scanner_factory or self._create_scanner
+        self.max_retries = max_retries
+        self.reconnect_delay = reconnect_delay
+        self.scanner = None
+        self.jobs = {}
+        self._queue = queue.Queue()
+        self._finished = threading.Condition()
+        self._next_id = 1
+        self._stopping = threading.Event()
+        self._server = None
+        self._threads = []
+        self._shutdown_lock = threading.Lock()
+
+    def _create_scanner(self):
+        """Connect to the Arduino with the default scanner settings."""
+        from scanviz.communication import Communication
+        from scanviz.scanner import Scanner
+        comms = Communication(
+            baudrate=self.baudrate, port=self.port, instrumentation=self.instrumentation
+        )
+        return Scanner(comms=comms)
+
+    def start(self):
+        """Start listening and working in background threads."""
+        if os.path.exists(self.socket_path):
+            try:
+                ScanClient(self.socket_path).request("jobs")
+            except OSError:
+                # Left behind by a service that did not shut down cleanly.
+                os.remove(self.socket_path)
+            else:
+                raise IOError(f"A scanner service is already listening on {self.socket_path}")
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, _RequestHandler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True),
+            threading.Thread(target=self._server.serve_forever, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Scanner service listening on {self.socket_path}")
+
+    def serve_forever(self):
+        """Start the service and block until it is shut down."""
+        self.start()
+        try:
+            self._stopping.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Stop accepting jobs, finish the running job and disconnect.
+
+        Jobs that are still queued fail.
+        """
+        self._stopping.set()
+        with self._shutdown_lock:
+            if self._server is None:
+                return
+            self._queue.put(None)
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+            while not self._queue.empty():
+                job = self._queue.get()
+                if job is not None:
+                    self._update(job, state="failed", error="The scanner service shut down.")
+            self._disconnect()
+        logger.info("Scanner service stopped.")
+
+    def submit(self, job_type, **params):
+        """Queue a job.
+
+        Parameters:
+            job_type (str): One of JOB_TYPES, the Scanner method to run.
+            **params: Keyword arguments of the job. "points" jobs take the
+                lists "pitches" and "yaws".
+        Returns:
+            (int): Id of the job.
+        """
+        if job_type not in self.JOB_TYPES:
+            raise ValueError(f"Unknown job type: {job_type}")
+        if self._stopping.is_set():
+            raise IOError("The scanner service is shutting down.")
+        with self._finished:
+            job = {
+                "id": self._next_id,
+                "type": job_type,
+                "params": params,
+                "state": "queued",
+                "submitted": time.time(),
+            }
+            self.jobs[job["id"]] = job
+            self._next_id += 1
+        self._queue.put(job)
+        logger.info(f"Queued {job_type} job {job['id']}.")
+        return job["id"]
+
+    def status(self, job_id):
+        """Current state of a job.
+
+        Parameters:
+            job_id (int): Id of the job.
+        Returns:
+            (dict): The job, with its "state" being "queued", "running", "done"
+                or "failed". Finished jobs hold a "result" or an "error".
+        """
+        with self._finished:
+            if job_id not in self.jobs:
+                raise ValueError(f"Unknown job: {job_id}")
+            return dict(self.jobs[job_id])
+
+    def wait(self, job_id, timeout=None):
+        """Wait until a job is finished.
+
+        Parameters:
+            job_id (int): Id of the job.
+            timeout (float): Maximum number of seconds to wait.
+        Returns:
+            (dict): The job, see status.
+        """
+        with self._finished:
+            self._finished.wait_for(
+                lambda: self.status(job_id)["state"] in ["done", "failed"], timeout
+            )
+        return self.status(job_id)
+
+    def _handle(self, request):
+        """Answer a request received on the socket."""
+        command = request.get("command")
+        if command == "submit":
+            return {"id": self.submit(request["type"], **request.get("params", {}))}
+        if command == "status":
+            return self.status(request["id"])
+        if command == "wait":
+            return self.wait(request["id"], request.get("timeout"))
+        if command == "jobs":
+            with self._finished:
+                return {
+                    "jobs": [
+                        {key: value for key, value in job.items() if key != "result"}
+                        for job in self.jobs.values()
+                    ]
+                }
+        if command == "shutdown":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {}
+        raise ValueError(f"Unknown command: {command}")
+
+    def _work(self):
+        """Run queued jobs one after another, run by the worker thread."""
+        try:
+            self._connect()
+        except IOError:
+            return
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            self._update(job, state="running", started=time.time())
+            for attempt in range(self.max_retries + 1):
+                try:
+                    if self.scanner is None:
+                        self._connect()
+                    result = self._run(job)
+                except Exception as error:
+                    logger.warning(f"Job {job['id']} failed: {error}")
+                    if not self._link_alive():
+                        # The next attempt or job reconnects.
+                        self._disconnect()
+                        self.instrumentation.count("reconnects")
+                        if attempt < self.max_retries:
+                            self.instrumentation.count("job_reruns")
+                            logger.info(f"Rerunning job {job['id']} after reconnecting.")
+                            continue
+                    self._update(job, state="failed", error=str(error), finished=time.time())
+                else:
+                    self._update(job, state="done", result=result, finished=time.time())
+                break
+
+    def _run(self, job):
+        """Run a job on the scanner.
+
+        Returns:
+            (dict): JSON serializable result of the job.
+        """
+        params = dict(job["params"])
+        if job["type"] == "sweep":
+            params.setdefault("visualize", "image_path" in params)
+            radius = self.scanner.sweep(**params)
+            return {"radius": radius.tolist()}
+        if job["type"] == "adaptive_sweep":
+            params.setdefault("visualize", "image_path" in params)
+            pitches, yaws, radius = self.scanner.adaptive_sweep(**params)
+            return {
+                "pitches": pitches.tolist(),
+                "yaws": yaws.tolist(),
+                "radius": radius.tolist(),
+            }
+        radius = [None] * len(params["pitches"])
+        try:
+            for point in self.scanner.iter_points(params["pitches"], params["yaws"]):
+                radius[point["index"]] = point["distance"]
+        finally:
+            self.scanner.instrumentation.scan_finished()
+        return {"radius": radius}
+
+    def _update(self, job, **fields):
+        """Change a job and wake up everyone waiting for jobs to finish."""
+        with self._finished:
+            job.update(fields)
+            self._finished.notify_all()
+
+    def _connect(self):
+        """Connect to the scanner, retrying with an increasing delay.
+
+        Raises:
+            IOError: when the service shuts down before connecting.
+        """
+        delay = self.reconnect_delay
+        while not self._stopping.is_set():
+            try:
+                self.scanner = self.scanner_factory()
+                logger.info("Scanner connected.")
+                return
+            except Exception as error:
+                self.instrumentation.count("connect_retries")
+                logger.warning(f"Could not connect to the scanner, retrying in {delay} s: {error}")
+                self._stopping.wait(delay)
+                delay = min(2 * delay, 30)
+        raise IOError("The scanner service is shutting down.")
+
+    def _disconnect(self):
+        """Close the link to the scanner, ignoring errors of a broken link."""
+        if self.scanner is None:
+            return
+        try:
+            self.scanner.comms.close()
+        except Exception as error:
+            logger.info(f"Error while disconnecting: {error}")
+        self.scanner = None
+
+    def _link_alive(self):
+        """Check whether the scanner still answers a test message."""
+        if self.scanner is None:
+            return False
+        try:
+            self.scanner.comms.arduino.reset_input_buffer()
+            response = self.scanner.comms.send_recieve("T", "12345")
+            return response["data"].startswith("12345")
+        except Exception:
+            return False
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Answer a single JSON request of a ScanClient."""
+
+    def handle(self):
+        try:
+            answer = {"response": self.server.service._handle(json.loads(self.rfile.readline()))}
+        except Exception as error:
+            answer = {"error": str(error)}
+        self.wfile.write(bytes(json.dumps(answer) + "\n", "utf-8"))
+
+
+class ScanClient():
+    """Submit scan jobs to a running ScannerService."""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=None):
+        """Instantiate a ScanClient object.
+
+        Parameters:
+            socket_path (str): Path of the Unix socket of the service.
+            timeout (float): Socket timeout in seconds.
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def request(self, command, **fields):
+        """Send a request to the service, see ScannerService.
+
+        Parameters:
+            command (str): Name of the command.
+            **fields: Other fields of the request.
+        Returns:
+            (dict): The answer.
+
+        Raises:
+            IOError: when the service answers with an error.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+            request = dict(fields, command=command)
+            connection.sendall(bytes(json.dumps(request) + "\n", "utf-8"))
+            with connection.makefile("rb") as answer_file:
+                answer = json.loads(answer_file.readline())
+        if "error" in answer:
+            raise IOError(answer["error"])
+        return answer["response"]
+
+    def submit(self, job_type, **params):
+        """Queue a job.
+
+        Parameters:
+            job_type (str): One of ScannerService.JOB_TYPES.
+            **params: Keyword arguments of the job.
+        Returns:
+            (int): Id of the job.
+        """
+        return self.request("submit", type=job_type, params=params)["id"]
+
+    def status(self, job_id):
+        """Current state of a job, see ScannerService.status."""
+        return self.request("status", id=job_id)
+
+    def wait(self, job_id, timeout=None):
+        """Wait until a job is finished, see ScannerService.wait."""
+        return self.request("wait", id=job_id, timeout=timeout)
+
+    def run(self, job_type, **params):
+        """Run a job and wait for its result.
+
+        Parameters:
+            job_type (str): One of ScannerService.JOB_TYPES.
+            **params: Keyword arguments of the job.
+        Returns:
+            (dict): Result of the job.
+
+        Raises:
+            IOError: when the job failed.
+        """
+        job = self.wait(self.submit(job_type, **params))
+        if job["state"] != "done":
+            raise IOError(f"Job {job['id']} failed: {job.get('error')}")
+        return job["result"]
+
+    def shutdown(self):
+        """Stop the service."""
+        self.request("shutdown")
@@ -0,0 +1,221 @@
+import json
+import logging
+import logging.config
+import os
+import struct
+import time
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# A scan file starts with MAGIC, the length of the header as a uint32 and a
+# JSON header describing the scanned points, padded to HEADER_ALIGNMENT bytes.
+# Fixed size records follow, one per measured point, in the order measured.
+MAGIC = b"SCANVIZ1"
+PREFIX = struct.Struct("<8sI")
+HEADER_ALIGNMENT = 64
+
+
+def record_dtype(samples):
+    """Numpy dtype of a single record.
+
+    Parameters:
+        samples (int): Number of raw ADC readings stored per point.
+    Returns:
+        (numpy.dtype): Packed little endian record layout.
+    """
+    return np.dtype([
+        ("index", "<u4"),
+        ("pitch", "<f4"),
+        ("yaw", "<f4"),
+        ("timestamp", "<f8"),
+        ("samples", "<u2", (samples,)),
+    ])
+
+
+def read_header(path):
+    """Read the header of a scan file.
+
+    Parameters:
+        path (str): Path of the scan file.
+    Returns:
+        (dict): The decoded header.
+        (int): Offset of the first record in bytes.
+    """
+    with open(path, "rb") as scan_file:
+        magic, length = PREFIX.unpack(scan_file.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a scan file: {path}")
+        header = json.loads(scan_file.read(length).decode("utf-8"))
+    return header, PREFIX.size + length
+
+
+class ScanWriter():
+    """Append measured points to a scan file in chunks."""
+
+    def __init__(self, path, pitches, yaws, samples=16, chunk_size=64, metadata=None):
+        """Create a new scan file.
+
+        Parameters:
+            path (str): Path of the scan file. It must not exist yet.
+            pitches (numpy.ndarray): Pitch angle of every point to be scanned.
+            yaws (numpy.ndarray): Yaw angle of every point, same shape as pitches.
+            samples (int): Number of raw ADC readings stored per point.
+            chunk_size (int): Number of points buffered before they are written
+                and synced to disk.
+            metadata (dict): Extra JSON serializable information to store.
+        """
+        header = {
+            "version": 1,
+            "created": time.time(),
+            "samples": samples,
+            "shape": list(np.shape(pitches)),
+            "pitches": np.ravel(pitches).tolist(),
+            "yaws": np.ravel(yaws).tolist(),
+            "metadata": metadata or {},
+        }
+        encoded = json.dumps(header).encode("utf-8")
+        padding = -(PREFIX.size + len(encoded)) % HEADER_ALIGNMENT
+        encoded += b" " * padding
+        with open(path, "xb") as scan_file:
+            scan_file.write(PREFIX.pack(MAGIC, len(encoded)))
+            scan_file.write(encoded)
+            scan_file.flush()
+            os.fsync(scan_file.fileno())
+        self._open(path, chunk_size)
+
+    @classmethod
+    def resume(cls, path, chunk_size=64):
+        """Reopen an interrupted scan file to append the missing points.
+
+        A record that was only partly written when the scan stopped is dropped.
+
+        Parameters:
+            path (str): Path of the scan file.
+            chunk_size (int): Number of points buffered before they are written.
+        Returns:
+            (ScanWriter): Writer appending to the existing file.
+        """
+        writer = cls.__new__(cls)
+        writer._open(path, chunk_size)
+        return writer
+
+    def _open(self, path, chunk_size):
+        """Open the file for appending and find the completed points."""
+        self.path = path
+        self.chunk_size = chunk_size
+        self.header, self.offset = read_header(path)
+        self.pitches = np.array(self.header["pitches"])
+        self.yaws = np.array(self.header["yaws"])
+        self.dtype = record_dtype(self.header["samples"])
+        count = (os.path.getsize(path) - self.offset) // self.dtype.itemsize
+        self._file = open(path, "r+b")
+        self._file.truncate(self.offset + count * self.dtype.itemsize)
+        self._file.seek(0, os.SEEK_END)
+        self._done = np.zeros(len(self.pitches), dtype=bool)
+        if count:
+            records = np.memmap(path, dtype=self.dtype, mode="r", offset=self.offset, shape=(count,))
+            self._done[records["index"]] = True
+            del records
+            logger.info(f"Resuming {path} after {count} of {len(self.pitches)} points.")
+        self._chunk = np.zeros(chunk_size, dtype=self.dtype)
+        self._buffered = 0
+
+    def remaining(self):
+        """Flat indices of the points that have not been stored yet.
+
+        Returns:
+            (numpy.ndarray): Indices into the flattened pitches and yaws.
+        """
+        return np.flatnonzero(~self._done)
+
+    def append(self, point):
+        """Buffer a measured point and write the chunk once it is full.
+
+        Parameters:
+            point (dict): Measured point as yielded by Scanner.iter_points, with
+                its index referring to the points of this file.
+        """
+        self._chunk[self._buffered] = (
+            point["index"],
+            point["pitch"],
+            point["yaw"],
+            point["timestamp"],
+            point["samples"],
+        )
+        self._done[point["index"]] = True
+        self._buffered += 1
+        if self._buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write and sync all buffered points."""
+        if self._buffered:
+            self._file.write(self._chunk[:self._buffered].tobytes())
+            self._buffered = 0
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Write the remaining points and close the file."""
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ScanReader():
+    """Lazily load a scan file. Records are memory mapped, not read up front."""
+
+    def __init__(self, path):
+        """Open a scan file.
+
+        Parameters:
+            path (str): Path of the scan file.
+        """
+        self.path = path
+        self.header, self.offset = read_header(path)
+        self.dtype = record_dtype(self.header["samples"])
+        self.shape = tuple(self.header["shape"])
+        self.pitches = np.array(self.header["pitches"]).reshape(self.shape)
+        self.yaws = np.array(self.header["yaws"]).reshape(self.shape)
+        count = (os.path.getsize(path) - self.offset) // self.dtype.itemsize
+        if count:
+            self.records = np.memmap(
+                path, dtype=self.dtype, mode="r", offset=self.offset, shape=(count,)
+            )
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def complete(self):
+        """(bool): True when every point of the scan has been stored."""
+        return len(np.unique(self.records["index"])) == np.prod(self.shape, dtype=int)
+
+    def radius(self, calibration, chunk_size=4096):
+        """Convert the stored readings into a radius array.
+
+        Parameters:
+            calibration (Calibration): Converts raw readings into inches.
+            chunk_size (int): Records converted at a time, bounding memory use.
+        Returns:
+            (numpy.ndarray): Distance of every point in the shape of the scan, NaN
+                where no point has been stored.
+        """
+        radius = np.full(self.shape, np.nan)
+        for start in range(0, len(self.records), chunk_size):
+            chunk = self.records[start:start + chunk_size]
+            radius.flat[chunk["index"]] = calibration.distance(chunk["samples"])
+        return radius
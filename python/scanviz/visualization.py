@@ -4,20 +4,82 @@ import logging.config
 import os
 
 import numpy as np
-import scipy.signal as scipy
-import matplotlib.pyplot as plt
-from matplotlib import ticker, cm
 
 logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.conf')
 logging.config.fileConfig(logger_path, disable_existing_loggers=False)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Matplotlib and scipy take long to import, so they are only imported once a
+# plot is drawn. Scanning without plotting never loads them.
+
+
+def to_cartesian(pitch, yaw, radius):
+    """Convert spherical scan coordinates into cartesian coordinates.
+
+    Parameters:
+        pitch (numpy.ndarray): Pitch angles in degrees.
+        yaw (numpy.ndarray): Yaw angles in degrees, same shape as pitch.
+        radius (numpy.ndarray): Distances, same shape as pitch.
+    Returns:
+        (numpy.ndarray): x, to the right of the scanner.
+        (numpy.ndarray): y, above the scanner.
+        (numpy.ndarray): z, in front of the scanner.
+    """
+    pitch_rad = np.deg2rad(pitch)
+    yaw_rad = np.deg2rad(yaw)
+    cos_pitch = np.cos(pitch_rad)
+    x = radius * np.sin(yaw_rad) * cos_pitch
+    y = radius * np.sin(pitch_rad)
+    z = radius * cos_pitch * np.cos(yaw_rad)
+    return x, y, z
+
+
+def decimate(max_points, *arrays):
+    """Keep every n-th point so that at most max_points remain.
+
+    Drawing a scatter plot slows down with every point, while beyond a few
+    thousand points the plot looks the same.
+
+    Parameters:
+        max_points (int): Maximum number of points to keep.
+        *arrays (numpy.ndarray): Coordinates of the points, all the same size.
+    Returns:
+        (list): The flattened arrays, decimated.
+    """
+    step = max(1, -(-np.size(arrays[0]) // max_points))
+    return [np.ravel(array)[::step] for array in arrays]
+
+
+def create_figure(offscreen, **kwargs):
+    """Create a figure, optionally without a window.
+
+    Parameters:
+        offscreen (bool): Render with Agg, independent of the pyplot backend,
+            so that figures can be saved without a display.
+        **kwargs: Passed on to the figure, e.g. figsize.
+    Returns:
+        (matplotlib.figure.Figure): The new figure.
+    """
+    if offscreen:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        fig = Figure(**kwargs)
+        FigureCanvasAgg(fig)
+        return fig
+    import matplotlib.pyplot as plt
+    return plt.figure(**kwargs)
+
+
 class Visualization():
     """Tools for visualizing scanner data."""
-    def __init__(self):
-        """Instantiate visualization object"""
-        pass
+    def __init__(self, max_points=20000):
+        """Instantiate visualization object
+
+        Parameters:
+            max_points (int): Maximum number of points drawn in the 3D render.
+        """
+        self.max_points = max_points
 
     def generate_mesh(self, resolution):
         """Generate pitch & yaw angles for scanning
@@ -36,40 +98,170 @@ class Visualization():
         return pitch_mesh, yaw_mesh
 
     def _moving_avg(self, data):
+        import scipy.signal
         window = np.ones((2, 2)) / 4
-        return scipy.convolve2d(data, window, 'valid')
-    
-    def create_viz(self, pitch, yaw, radius):
-        """Create a matplotlib graph to visualize the data."""
-        smooth_radius = self._moving_avg(radius) 
-        pitch_rad = [row[1:] for row in np.deg2rad(pitch)[1:,:]]
-        yaw_rad = [row[1:] for row in np.deg2rad(yaw)[1:,:]]
+        return scipy.signal.convolve2d(data, window, 'valid')
+
+    def create_viz(self, pitch, yaw, radius, path=None):
+        """Create a matplotlib graph to visualize the data.
+
+        The angles and radius are either meshes, which are smoothed before
+        plotting, or 1D arrays of scattered points like those of an adaptive scan.
+
+        Parameters:
+            pitch (numpy.ndarray): Pitch angle of every point.
+            yaw (numpy.ndarray): Yaw angle of every point.
+            radius (numpy.ndarray): Measured distance of every point.
+            path (str): Optional image file, e.g. a .png or .svg. The graph is
+                rendered off screen and saved instead of shown in a window, so
+                no display is needed.
+        """
+        from matplotlib.figure import figaspect
+        fig = create_figure(path is not None, figsize=figaspect(2.))
+        self.draw(fig, pitch, yaw, radius)
+        if path is not None:
+            fig.savefig(path)
+            logger.info(f"Saved scan visualization to {path}")
+        else:
+            import matplotlib.pyplot as plt
+            plt.show()
+
+    def draw(self, fig, pitch, yaw, radius):
+        """Draw the contour and 3D render of a scan onto a figure.
+
+        Parameters:
+            fig (matplotlib.figure.Figure): Figure to draw on.
+            pitch (numpy.ndarray): Pitch angle of every point.
+            yaw (numpy.ndarray): Yaw angle of every point.
+            radius (numpy.ndarray): Measured distance of every point.
+        """
+        if np.ndim(radius) == 1:
+            smooth_radius = np.asarray(radius)
+            pitch = np.asarray(pitch)
+            yaw = np.asarray(yaw)
+        else:
+            smooth_radius = self._moving_avg(radius)
+            pitch = np.asarray(pitch)[1:, 1:]
+            yaw = np.asarray(yaw)[1:, 1:]
         # Unfiltered Output
         # smooth_radius = radius
-        # pitch_rad = np.deg2rad(pitch)
-        # yaw_rad = np.deg2rad(yaw)
-        x = smooth_radius * np.sin(yaw_rad) * np.cos(pitch_rad)
-        y = smooth_radius * np.sin(pitch_rad)
-        z = smooth_radius * np.cos(pitch_rad) * np.cos(yaw_rad)
+        x, y, z = to_cartesian(pitch, yaw, smooth_radius)
 
-        fig = plt.figure(figsize=plt.figaspect(2.))
         fig.suptitle('3D Scan')
 
         # 2D Contour
         ax_2D = fig.add_subplot(1, 2, 2)
 
-        contour = ax_2D.contourf(x, y, z)
+        if np.ndim(radius) == 1:
+            contour = ax_2D.tricontourf(x, y, z)
+        else:
+            contour = ax_2D.contourf(x, y, z)
         ax_2D.set_aspect('equal', 'box')
         fig.colorbar(contour, ax=ax_2D, shrink=0.5)
 
-        # 3D Render   
+        # 3D Render
         ax_3D = fig.add_subplot(1, 2, 1, projection='3d')
 
-        surf = ax_3D.scatter(
+        x, y, z = decimate(self.max_points, x, y, z)
+        ax_3D.scatter(
             x,
             z,
             y,
         )
 
         fig.tight_layout()
-        plt.show()
\ No newline at end of file
+
+
+class LivePlot():
+    """3D scatter plot that grows while a scan streams in points."""
+
+    def __init__(self, path=None, refresh=0.5, max_points=20000):
+        """Instantiate a LivePlot object.
+
+        Parameters:
+            path (str): Optional image file that is rewritten on every refresh
+                instead of showing a window, for scanners without a display.
+            refresh (float): Minimum seconds between two redraws. Points that
+                arrive in between are only buffered.
+            max_points (int): Maximum number of points drawn, see decimate.
+        """
+        self.path = path
+        self.refresh = refresh
+        self.max_points = max_points
+        self.fig = create_figure(path is not None)
+        self.fig.suptitle('3D Scan')
+        self.ax = self.fig.add_subplot(1, 1, 1, projection='3d')
+        self.scatter = None
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.z = np.empty(0)
+        self._drawn = [np.empty(0)] * 3
+        self._step = 1
+        self._pending = []
+        self._drawn_at = 0.0
+        if path is None:
+            import matplotlib.pyplot as plt
+            plt.show(block=False)
+
+    def update(self, points):
+        """Add measured points and redraw if the refresh interval has passed.
+
+        Parameters:
+            points (list): Measured points as yielded by Scanner.iter_points.
+        """
+        self._pending += [
+            (point["pitch"], point["yaw"], point["distance"]) for point in points
+        ]
+        if time.monotonic() - self._drawn_at >= self.refresh:
+            self.draw()
+
+    def consume(self, points):
+        """Update the plot with every point of a stream, passing them through.
+
+        Parameters:
+            points (iterable): Measured points, e.g. from Scanner.iter_points.
+        Yields:
+            (dict): The points unchanged.
+        """
+        for point in points:
+            self.update([point])
+            yield point
+        self.draw()
+
+    def draw(self):
+        """Convert the buffered points and add them to the scatter plot.
+
+        The scatter artist is created once, later refreshes only convert the
+        new points and update its offsets and colors in place. Every n-th point
+        is drawn, see decimate, where n doubles whenever max_points is exceeded.
+        """
+        self._drawn_at = time.monotonic()
+        if not self._pending:
+            return
+        pitch, yaw, radius = np.array(self._pending, dtype=float).T
+        self._pending = []
+        x, y, z = to_cartesian(pitch, yaw, radius)
+        keep = (len(self.x) + np.arange(len(x))) % self._step == 0
+        self.x = np.concatenate([self.x, x])
+        self.y = np.concatenate([self.y, y])
+        self.z = np.concatenate([self.z, z])
+        # Plotted as (x, z, y) so that the vertical axis of the scanner is up.
+        self._drawn = [
+            np.concatenate([drawn, new[keep]]) for drawn, new in zip(self._drawn, (x, z, y))
+        ]
+        while len(self._drawn[0]) > self.max_points:
+            self._step *= 2
+            self._drawn = [drawn[::2] for drawn in self._drawn]
+        colors = self._drawn[1]
+        if self.scatter is None:
+            self.scatter = self.ax.scatter(*self._drawn, c=colors, cmap="viridis")
+        else:
+            self.scatter._offsets3d = tuple(self._drawn)
+            self.scatter.set_array(colors)
+            self.scatter.set_clim(colors.min(), colors.max())
+            self.ax.auto_scale_xyz(x, z, y, had_data=True)
+        if self.path is not None:
+            self.fig.savefig(self.path)
+        else:
+            self.fig.canvas.draw_idle()
+            self.fig.canvas.flush_events()
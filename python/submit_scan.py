@@ -0,0 +1,9 @@
+import os
+import sys
+
+from scanviz.service import ScanClient
+
+resolution = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+image_path = sys.argv[2] if len(sys.argv) > 2 else "scan.png"
+ScanClient().run("sweep", resolution=resolution, image_path=os.path.abspath(image_path))
+print(f"Saved scan to {image_path}")
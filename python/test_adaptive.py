@@ -0,0 +1,45 @@
+from scanviz.adaptive import AdaptiveSweep
+from scanviz.emulator import fast_scanner
+import logging
+import logging.config
+import os
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scanviz/logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def step_scene(pitch, yaw):
+    return 15.0 if yaw > 2 else 35.0
+
+
+def test_refines_edges():
+    with fast_scanner(scene=step_scene) as scanner:
+        pitches, yaws, radius = AdaptiveSweep(
+            scanner, coarse_resolution=5, max_points=60, max_depth=2
+        ).run()
+        assert 25 < len(pitches) <= 60
+        assert len(set(zip(pitches, yaws))) == len(pitches)
+        # Only cells around the step at yaw = 2 degrees are refined.
+        refined = yaws[~np.isin(yaws, np.linspace(-30, 30, 5))]
+        assert len(refined) and np.all(np.abs(refined - 2) <= 15)
+        assert np.all((radius < 25) == (yaws > 2))
+
+
+def test_uneven_coarse_grid():
+    # A spacing of 60 / 7 degrees does not round exactly to the point keys.
+    with fast_scanner(scene=step_scene) as scanner:
+        pitches, yaws, radius = AdaptiveSweep(
+            scanner, coarse_resolution=8, max_points=80, max_depth=1
+        ).run()
+        assert 64 < len(pitches) <= 80
+        assert len(set(zip(pitches, yaws))) == len(pitches)
+
+
+if __name__ == "__main__":
+    test_refines_edges()
+    test_uneven_coarse_grid()
+    print("Adaptive OK")
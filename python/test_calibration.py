@@ -0,0 +1,53 @@
+from scanviz.calibration import Calibration
+import logging
+import logging.config
+import os
+import tempfile
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scanviz/logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def test_convert():
+    # The default matches the original get_distance, the mean of the converted readings.
+    calibration = Calibration()
+    samples = np.array([[100, 200], [300, 1023]])
+    expected = 48.7 - 0.15 * samples + 0.000134 * samples**2
+    assert np.allclose(calibration.convert(samples), expected)
+    assert np.allclose(calibration.distance(samples), expected.mean(axis=1))
+
+
+def test_aggregation():
+    samples = np.array([300] * 14 + [0, 1023])
+    median = Calibration(aggregation="median").distance(samples)
+    trimmed = Calibration(aggregation="trimmed", trim=0.2).distance(samples)
+    plain = Calibration(aggregation="mean").distance(samples)
+    spike_free = Calibration().convert(300)
+    assert np.isclose(median, spike_free) and np.isclose(trimmed, spike_free)
+    assert not np.isclose(plain, spike_free)
+
+
+def test_fit():
+    truth = Calibration()
+    samples = np.arange(50, 550, 25)
+    fitted = Calibration.fit(samples, truth.convert(samples))
+    assert np.allclose(fitted.coefficients, truth.coefficients)
+    with tempfile.TemporaryDirectory() as directory:
+        recordings = {}
+        for distance, reading in [(10, 480), (20, 230), (30, 130)]:
+            path = os.path.join(directory, f"{distance}in.txt")
+            np.savetxt(path, [reading - 2, reading, reading + 2], fmt="%d")
+            recordings[distance] = path
+        fitted = Calibration.from_recordings(recordings)
+        assert abs(fitted.distance([480, 480]) - 10) < 0.5
+
+
+if __name__ == "__main__":
+    test_convert()
+    test_aggregation()
+    test_fit()
+    print("Calibration OK")
@@ -0,0 +1,178 @@
+from scanviz.communication import Communication
+from scanviz.emulator import EmulatedArduino, distance_to_adc
+from scanviz.instrumentation import Instrumentation
+from scanviz.scanner import Scanner
+import logging
+import logging.config
+import os
+import time
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scanviz/logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def test_protocol():
+    with EmulatedArduino(settle_time=0.1, seed=0) as device:
+        comms = Communication(port=device)
+        assert comms.send_recieve("T", "12345")["data"] == "12345"
+        assert comms.send_recieve("M", "150+090")["data"] == "1"
+        readings = comms.send_recieve("S", "GET")["data"].split(",")
+        assert len(readings) == 16
+        assert device.bytes_written > 0 and device.bytes_read > 0
+
+
+def test_closed_port():
+    device = EmulatedArduino()
+    device.close()
+    for read in [device.read, device.read_until]:
+        try:
+            read()
+        except IOError:
+            pass
+        else:
+            raise AssertionError("Reading a closed port did not fail.")
+
+
+def test_binary_frames():
+    with EmulatedArduino(settle_time=0.1, seed=0) as device:
+        comms = Communication(port=device)
+        assert comms.protocol_version == Communication.PROTOCOL_VERSION
+        response = comms.send_recieve("S", "BIN")
+        assert response["error"] == 0
+        assert response["data"].dtype == "<u2" and len(response["data"]) == 16
+        frame = bytearray(Communication.encode_frame("S", [1, 2, 3]))
+        frame[8] ^= 0xFF
+        device._send(bytes(frame))
+        assert comms.receive()["error"] == 3
+    with EmulatedArduino(settle_time=0.1, protocol_version=0) as device:
+        comms = Communication(port=device)
+        assert comms.protocol_version == 0
+        assert len(comms.send_recieve("S", "GET")["data"].split(",")) == 16
+
+
+def test_pipeline():
+    with EmulatedArduino(settle_time=0.1, seed=0) as device:
+        comms = Communication(port=device)
+        comms.start_pipeline(window=3)
+        futures = [comms.send_async("S", "BIN") for _ in range(5)]
+        assert all(len(f.result()["data"]) == 16 for f in futures)
+        assert [f.result()["sequence"] for f in futures] == [0, 1, 2, 3, 4]
+        assert comms.send_recieve("T", "12345")["data"] == "12345"
+        comms.stop_pipeline()
+        assert not comms.pipelined
+        assert comms.send_recieve("M", "150+090")["data"] == "1"
+
+
+def test_pipeline_unknown_sequence():
+    instrumentation = Instrumentation()
+    with EmulatedArduino(settle_time=0.2, seed=0) as device:
+        comms = Communication(port=device, instrumentation=instrumentation)
+        comms.start_pipeline(window=2)
+        future = comms.send_async("M", "150+090")
+        device._send(b"M99#7\r\n")
+        response = future.result(timeout=3)
+        assert response["data"] != "99" and response["sequence"] == 0
+        assert instrumentation.counters["dropped_messages"] == 1
+        comms.close()
+
+
+def test_pipeline_idle():
+    with EmulatedArduino(settle_time=0.5, timeout=1, seed=0) as device:
+        comms = Communication(port=device)
+        comms.start_pipeline(window=2)
+        # The reader's read times out before the answer to the command arrives.
+        time.sleep(0.8)
+        readings = list(comms.send_stream("R", "150+090@50", "P"))
+        assert len(readings) == 1
+        comms.close()
+
+
+def test_pipeline_reader_failure():
+    with EmulatedArduino(settle_time=0.1, seed=0) as device:
+        comms = Communication(port=device)
+        comms.start_pipeline(window=2)
+        device._send(b"S\xff\xfe\r\n")
+        try:
+            comms.send_async("T", "12345").result(timeout=3)
+        except (IOError, RuntimeError):
+            # RuntimeError if the pipeline already stopped before sending.
+            pass
+        else:
+            raise AssertionError("The undecodable response did not fail the pipeline.")
+        assert not comms.pipelined
+        comms.close()
+
+
+def test_pipeline_close_after_dropout():
+    with EmulatedArduino(settle_time=0.1, timeout=0.5, seed=0) as device:
+        comms = Communication(port=device)
+        comms.start_pipeline(window=2)
+        device.close()
+        start = time.monotonic()
+        try:
+            comms.close()
+        except IOError:
+            # The stop command failed, the port is closed all the same.
+            pass
+        assert time.monotonic() - start < 2
+        assert not comms.pipelined
+
+
+def test_scan_line():
+    with EmulatedArduino(settle_time=0.01, adc_noise=0, seed=0) as device:
+        scanner = Scanner(comms=Communication(port=device))
+        assert scanner.comms.protocol_version == 2
+        radius = scanner.scan_line([0, 0, 20], [0, 20, 20])
+        assert len(radius) == 3 and abs(radius[0] - 18) < 0.5
+        scanner.comms.start_pipeline(window=2)
+        assert abs(scanner.scan_line([0, 0, 20], [0, 20, 20]) - radius).max() < 0.5
+        scanner.comms.stop_pipeline()
+        # A line of 60 targets with settle times does not fit into the
+        # message buffer of the Arduino and is split.
+        yaws = np.linspace(-30, 30, 60)
+        assert len(scanner.scan_line(np.zeros(60), yaws, np.full(60, 0.01))) == 60
+
+
+def test_sweep():
+    with EmulatedArduino(settle_time=0.01, adc_noise=0, seed=0) as device:
+        scanner = Scanner(comms=Communication(port=device))
+        radius = scanner.sweep(3, visualize=False)
+        assert radius.shape == (3, 3)
+        # The center of the default scene is a box 18 inches away.
+        assert abs(radius[1][1] - 18) < 0.5
+        assert distance_to_adc(18) > distance_to_adc(36)
+        scanner.comms.start_pipeline()
+        assert abs(scanner.sweep(3, visualize=False) - radius).max() < 0.5
+        scanner.comms.stop_pipeline()
+
+
+def test_iter_sweep():
+    with EmulatedArduino(settle_time=0.01, adc_noise=0, seed=0) as device:
+        scanner = Scanner(comms=Communication(port=device))
+        points = scanner.iter_sweep(4, buffer_size=2)
+        first = next(points)
+        assert len(first["samples"]) == 16 and first["distance"] > 0
+        points.close()
+        # Closing early leaves the link usable.
+        assert scanner.comms.send_recieve("T", "12345")["data"] == "12345"
+        indices = sorted(point["index"] for point in scanner.iter_sweep(4))
+        assert indices == list(range(16))
+
+
+if __name__ == "__main__":
+    test_protocol()
+    test_closed_port()
+    test_binary_frames()
+    test_pipeline()
+    test_pipeline_unknown_sequence()
+    test_pipeline_idle()
+    test_pipeline_reader_failure()
+    test_pipeline_close_after_dropout()
+    test_scan_line()
+    test_sweep()
+    test_iter_sweep()
+    print("Emulator OK")
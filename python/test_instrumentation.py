@@ -0,0 +1,66 @@
+from scanviz.communication import Communication
+from scanviz.emulator import EmulatedArduino, fast_scanner
+from scanviz.instrumentation import Instrumentation
+import json
+import logging
+import logging.config
+import os
+import tempfile
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scanviz/logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def test_disabled():
+    instrumentation = Instrumentation(enabled=False)
+    with instrumentation.span("write"):
+        pass
+    instrumentation.count("empty_responses")
+    assert not instrumentation.events and not instrumentation.counters
+
+
+def test_sweep_trace():
+    with tempfile.TemporaryDirectory() as directory:
+        trace_path = os.path.join(directory, "trace.json")
+        instrumentation = Instrumentation(trace_path=trace_path)
+        for protocol_version in [0, Communication.PROTOCOL_VERSION]:
+            with fast_scanner(instrumentation, protocol_version=protocol_version) as scanner:
+                scanner.sweep(3, visualize=False)
+            # Every sweep reports and resets, so the counts do not add up.
+            assert not instrumentation.events
+            phases = instrumentation.last_summary["phases"]
+            assert phases["calibrate"]["count"] == 9
+            assert sum(phases["wait"]["histogram"]) == phases["wait"]["count"]
+            assert phases["wait"]["p50"] <= phases["wait"]["max"]
+            with open(trace_path) as trace_file:
+                events = json.load(trace_file)["traceEvents"]
+            assert {event["name"] for event in events} == set(phases)
+            assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+            # Version 0 waits for the servos on the host, version 2 on the device.
+            assert ("settle" in phases) == (protocol_version == 0)
+        assert "phase" in instrumentation.report()
+
+
+def test_error_counters():
+    instrumentation = Instrumentation()
+    with EmulatedArduino(timeout=0.1) as device:
+        comms = Communication(port=device, instrumentation=instrumentation)
+        assert comms.receive()["error"] == 2
+    assert instrumentation.counters == {"empty_responses": 1}
+    with fast_scanner(instrumentation) as scanner:
+        try:
+            list(scanner._stream_message(["xxx+yyy"]))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("The emulator accepted an invalid target.")
+    assert instrumentation.counters["servo_failures"] == 1
+
+
+if __name__ == "__main__":
+    test_disabled()
+    test_sweep_trace()
+    test_error_counters()
+    print("Instrumentation OK")
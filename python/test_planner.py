@@ -0,0 +1,62 @@
+from scanviz.benchmark import SweepBenchmark
+from scanviz.communication import Communication
+from scanviz.emulator import EmulatedArduino
+from scanviz.planner import PathPlanner
+from scanviz.scanner import Scanner
+from scanviz.visualization import Visualization
+import logging
+import logging.config
+import os
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scanviz/logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def test_orders():
+    pitch, yaw = Visualization().generate_mesh(4)
+    for order in PathPlanner.ORDERS:
+        plan = PathPlanner(order=order).plan(pitch, yaw)
+        assert sorted(plan["order"]) == list(range(16))
+        assert len(plan["settle_times"]) == 16
+    assert list(PathPlanner("serpentine").plan(pitch, yaw)["order"][:8]) == [0, 1, 2, 3, 7, 6, 5, 4]
+    assert list(PathPlanner("spiral").plan(pitch, yaw)["order"][:6]) == [0, 1, 2, 3, 7, 11]
+
+
+def test_integer_points():
+    # Scattered integer angles fall back to nearest order, which marks visited
+    # points with infinity.
+    plan = PathPlanner().plan(np.array([0, 10, 1]), np.array([0, 10, 1]))
+    assert list(plan["order"]) == [0, 2, 1]
+    pitch, yaw = np.meshgrid(np.arange(3), np.arange(3))
+    assert sorted(PathPlanner("nearest").plan(pitch, yaw)["order"]) == list(range(9))
+
+
+def test_settle_times():
+    planner = PathPlanner(min_settle=0.1, seconds_per_degree=0.01, max_settle=1.5)
+    settle_times = planner.settle_times(np.array([0, 0, 10, 10]), np.array([0, 5, 5, 100]))
+    assert np.allclose(settle_times, [1.5, 0.15, 0.2, 1.05])
+    raster = PathPlanner("raster").plan(*Visualization().generate_mesh(10))
+    serpentine = PathPlanner("serpentine").plan(*Visualization().generate_mesh(10))
+    assert serpentine["estimated_time"] < raster["estimated_time"]
+    # Sweeps wait as long as the planner says, so the benchmark plans with its settle time.
+    plan = SweepBenchmark(settle_time=0.3).planner.plan(*Visualization().generate_mesh(3))
+    assert np.allclose(plan["settle_times"], 0.3)
+
+
+def test_sweep_order():
+    with EmulatedArduino(adc_noise=0, seed=0) as device:
+        raster = Scanner(comms=Communication(port=device), planner=PathPlanner("raster"))
+        nearest = Scanner(comms=raster.comms, planner=PathPlanner("nearest"))
+        assert np.abs(raster.sweep(4, visualize=False) - nearest.sweep(4, visualize=False)).max() < 0.5
+
+
+if __name__ == "__main__":
+    test_orders()
+    test_integer_points()
+    test_settle_times()
+    test_sweep_order()
+    print("Planner OK")
@@ -0,0 +1,57 @@
+from scanviz.emulator import EmulatedArduino, fast_planner
+from scanviz.instrumentation import Instrumentation
+from scanviz.pool import ScannerPool
+import logging
+import logging.config
+import os
+import threading
+import time
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scanviz/logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def timed_sweep(devices, resolution):
+    with ScannerPool(ports=devices, planner=fast_planner()) as pool:
+        start = time.monotonic()
+        radius = pool.sweep(resolution, visualize=False)
+        return radius, time.monotonic() - start
+
+
+def test_pool_scales():
+    with EmulatedArduino(adc_noise=0, seed=0) as device:
+        single, single_time = timed_sweep([device], 6)
+    devices = [EmulatedArduino(adc_noise=0, seed=seed) for seed in range(3)]
+    try:
+        merged, pool_time = timed_sweep(devices, 6)
+    finally:
+        for device in devices:
+            device.close()
+    assert np.allclose(single, merged)
+    assert pool_time < 0.7 * single_time
+
+
+def test_device_drops_out():
+    devices = [EmulatedArduino(adc_noise=0, seed=seed) for seed in range(2)]
+    try:
+        instrumentation = Instrumentation()
+        with ScannerPool(ports=devices, planner=fast_planner(), instrumentation=instrumentation) as pool:
+            pitches, yaws = pool.scanners[0].viz.generate_mesh(6)
+            threading.Timer(0.5, devices[1].close).start()
+            indices = [point["index"] for point in pool.iter_points(pitches, yaws)]
+            assert sorted(indices) == list(range(36))
+            assert len(pool.scanners) == 1
+            assert instrumentation.counters["requeued_points"] > 0
+    finally:
+        for device in devices:
+            device.close()
+
+
+if __name__ == "__main__":
+    test_pool_scales()
+    test_device_drops_out()
+    print("Pool OK")
@@ -0,0 +1,68 @@
+from scanviz.emulator import fast_scanner
+from scanviz.visualization import LivePlot, Visualization, decimate, to_cartesian
+import logging
+import logging.config
+import os
+import tempfile
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scanviz/logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def test_to_cartesian():
+    x, y, z = to_cartesian(np.array([0, 90, 0]), np.array([0, 0, 90]), np.array([2, 3, 4]))
+    assert np.allclose(x, [0, 0, 4])
+    assert np.allclose(y, [0, 3, 0])
+    assert np.allclose(z, [2, 0, 0])
+
+
+def test_decimate():
+    x, y = decimate(100, np.arange(1000), np.arange(1000).reshape(10, 100))
+    assert len(x) == len(y) == 100
+    assert len(decimate(100, np.arange(10))[0]) == 10
+
+
+def test_offscreen_render():
+    viz = Visualization(max_points=50)
+    pitch, yaw = viz.generate_mesh(20)
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ["scan.png", "scan.svg"]:
+            path = os.path.join(directory, name)
+            viz.create_viz(pitch, yaw, 20 + pitch / 10, path=path)
+            assert os.path.getsize(path) > 0
+
+
+def test_live_sweep():
+    with tempfile.TemporaryDirectory() as directory, fast_scanner() as scanner:
+        live = LivePlot(path=os.path.join(directory, "live.png"), refresh=0)
+        image_path = os.path.join(directory, "scan.png")
+        radius = scanner.sweep(4, path=None, image_path=image_path, live=live)
+        assert len(live.x) == radius.size == 16
+        assert os.path.exists(live.path) and os.path.exists(image_path)
+
+
+def test_live_update_in_place():
+    with tempfile.TemporaryDirectory() as directory:
+        live = LivePlot(path=os.path.join(directory, "live.png"), refresh=0, max_points=10)
+        live.update([{"pitch": 0, "yaw": yaw, "distance": 10} for yaw in range(8)])
+        scatter = live.scatter
+        live.update([{"pitch": 10, "yaw": yaw, "distance": 20} for yaw in range(8)])
+        assert live.scatter is scatter
+        assert len(live.ax.collections) == 1
+        assert len(live.x) == 16
+        # Every second point is drawn once max_points is exceeded.
+        assert len(live.scatter._offsets3d[0]) == 8
+        assert np.allclose(live.scatter._offsets3d[0], live.x[::2])
+
+
+if __name__ == "__main__":
+    test_to_cartesian()
+    test_decimate()
+    test_offscreen_render()
+    test_live_sweep()
+    test_live_update_in_place()
+    print("Render OK")
@@ -0,0 +1,109 @@
+from scanviz.communication import Communication
+from scanviz.emulator import EmulatedArduino, fast_planner
+from scanviz.instrumentation import Instrumentation
+from scanviz.scanner import Scanner
+from scanviz.service import ScanClient, ScannerService
+import logging
+import logging.config
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scanviz/logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def test_lazy_imports():
+    code = (
+        "import sys, scanviz, scanviz.service, scanviz.scanner\n"
+        "assert scanviz.Scanner is scanviz.scanner.Scanner\n"
+        "assert 'matplotlib' not in sys.modules and 'scipy' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_handshake_polling():
+    instrumentation = Instrumentation()
+    with EmulatedArduino(boot_time=1.0) as device:
+        start = time.monotonic()
+        comms = Communication(port=device, instrumentation=instrumentation)
+        assert 1.0 < time.monotonic() - start < 3.0
+        assert instrumentation.counters["handshake_retries"] > 0
+        assert comms.protocol_version == Communication.PROTOCOL_VERSION
+        # Answers to the handshakes sent while booting must not linger.
+        assert comms.send_recieve("T", "12345")["data"].startswith("12345")
+
+
+def test_stale_port_cache():
+    port_cache, discover_ports = Communication.PORT_CACHE, Communication.__dict__["discover_ports"]
+    with tempfile.TemporaryDirectory() as directory:
+        Communication.PORT_CACHE = os.path.join(directory, "port")
+        Communication.discover_ports = staticmethod(lambda: [])
+        try:
+            Communication.remember_port(os.devnull)
+            # The cached port is not a serial port, so discovery runs instead.
+            try:
+                Communication()
+            except IOError as error:
+                assert str(error) == "No Arduino found."
+            else:
+                raise AssertionError("Connected without an Arduino.")
+            assert Communication.cached_port() is None
+        finally:
+            Communication.PORT_CACHE, Communication.discover_ports = port_cache, discover_ports
+
+
+def test_service_reconnects():
+    devices = []
+    instrumentation = Instrumentation()
+
+    def connect():
+        devices.append(EmulatedArduino(adc_noise=0, seed=0))
+        comms = Communication(port=devices[-1])
+        return Scanner(comms=comms, planner=fast_planner(), instrumentation=instrumentation)
+
+    with tempfile.TemporaryDirectory() as directory:
+        service = ScannerService(
+            socket_path=os.path.join(directory, "scanviz.sock"),
+            scanner_factory=connect,
+            reconnect_delay=0.1,
+            instrumentation=instrumentation,
+        )
+        service.start()
+        client = ScanClient(service.socket_path)
+        radius = client.run("sweep", resolution=3)["radius"]
+        assert np.shape(radius) == (3, 3)
+        points = client.run("points", pitches=[0, 10], yaws=[0, 20])["radius"]
+        assert len(points) == 2
+        # A job that fails by itself is not retried.
+        job = client.wait(client.submit("sweep", resolution=100))
+        assert job["state"] == "failed" and len(devices) == 1
+        # The device drops out, the service reconnects and reruns the job.
+        devices[0].close()
+        radius = client.run("sweep", resolution=3)["radius"]
+        counters = instrumentation.last_summary["counters"]
+        assert counters["reconnects"] == counters["job_reruns"] == 1
+        assert np.allclose(radius, client.run("sweep", resolution=3)["radius"])
+        assert len(devices) == 2
+        assert len(client.request("jobs")["jobs"]) == 5
+        client.shutdown()
+        deadline = time.monotonic() + 5
+        while os.path.exists(service.socket_path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not os.path.exists(service.socket_path)
+        for device in devices:
+            device.close()
+
+
+if __name__ == "__main__":
+    test_lazy_imports()
+    test_handshake_polling()
+    test_stale_port_cache()
+    test_service_reconnects()
+    print("Service OK")
@@ -0,0 +1,83 @@
+from scanviz.communication import Communication
+from scanviz.emulator import EmulatedArduino
+from scanviz.scanner import Scanner
+from scanviz.storage import ScanReader, ScanWriter
+import gc
+import logging
+import logging.config
+import os
+import tempfile
+import warnings
+
+import numpy as np
+
+logger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scanviz/logging.conf')
+logging.config.fileConfig(logger_path, disable_existing_loggers=False)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def point(index):
+    return {
+        "index": index,
+        "pitch": index,
+        "yaw": -index,
+        "timestamp": 1.0 + index,
+        "samples": np.full(16, 100 + index),
+    }
+
+
+def test_resume_after_crash():
+    pitches, yaws = np.meshgrid(np.arange(3.0), np.arange(2.0))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "scan.bin")
+        writer = ScanWriter(path, pitches, yaws, chunk_size=2)
+        for index in range(3):
+            writer.append(point(index))
+        # Crash: the buffered third point is lost and a record is cut short.
+        writer._file.write(b"\x01\x02\x03")
+        writer._file.close()
+        with ScanWriter.resume(path) as writer:
+            assert list(writer.remaining()) == [2, 3, 4, 5]
+            for index in writer.remaining():
+                writer.append(point(int(index)))
+        reader = ScanReader(path)
+        assert len(reader) == 6 and reader.complete
+        assert reader.records["samples"][5][0] == 105
+        assert reader.pitches.shape == (2, 3)
+
+
+def test_scanner_record():
+    with tempfile.TemporaryDirectory() as directory, EmulatedArduino(adc_noise=0, seed=0) as device:
+        path = os.path.join(directory, "scan.bin")
+        scanner = Scanner(comms=Communication(port=device))
+        pitches, yaws = scanner.viz.generate_mesh(4)
+        with ScanWriter(path, pitches, yaws) as writer:
+            for count, measured in enumerate(scanner.iter_points(pitches, yaws)):
+                writer.append(measured)
+                if count == 6:
+                    break
+        radius = scanner.sweep(4, visualize=False, path=path)
+        assert not np.isnan(radius).any()
+        assert len(ScanReader(path)) == 16
+        # A fresh scan follows the rows of the mesh in the planner's order.
+        fresh_path = os.path.join(directory, "fresh.bin")
+        scanner.sweep(4, visualize=False, path=fresh_path)
+        order = scanner.planner.plan(pitches, yaws)["order"]
+        assert list(ScanReader(fresh_path).records["index"]) == list(order)
+        # A file of another resolution is rejected, not broadcast.
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", ResourceWarning)
+            try:
+                scanner.sweep(3, visualize=False, path=path)
+            except ValueError as error:
+                assert "different scan" in str(error)
+            else:
+                raise AssertionError("Resumed a scan of another resolution.")
+            gc.collect()
+
+
+if __name__ == "__main__":
+    test_resume_after_crash()
+    test_scanner_record()
+    print("Storage OK")